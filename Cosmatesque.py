@@ -1,12 +1,14 @@
+import time
+startup_time = time.perf_counter()   # for measuring time to first window
+
 import PySimpleGUIQt as sg  # Qt version necessary for changeable button color on Mac
 import random
-import os, sys, subprocess
-from PIL import Image
-import fractal as fr
+import io, os, sys, subprocess, types
+import logging, queue, threading
+# fractal and store (with numpy and Pillow) are imported once the window is showing, see below
 
 # TO DO
 # On Mac:
-# Get "Save" button label to change to "Working..." immediately upon click
 # Get window element centering to work
 # On Linux:
 # Test program, set appearance parameters
@@ -15,6 +17,20 @@ import fractal as fr
 # Constants
 CA_SIZE = 3
 MAX_MODULUS = 5
+FIRST_WINDOW_BUDGET_SECONDS = 2.0   # time to first window beyond which startup counts as too slow
+GALLERY_ROWS = 4
+GALLERY_COLUMNS = 4
+
+# Stats mode: run with --stats, or set COSMATESQUE_STATS to 1 or to a log file name, to log the
+# time (and, under PYTHONTRACEMALLOC=1, peak memory) of every render stage as JSON lines
+stats_destination = os.environ.get('COSMATESQUE_STATS') or ('1' if '--stats' in sys.argv else None)
+if stats_destination:
+    logging.basicConfig(level=logging.INFO, format='%(message)s',
+                        filename=None if stats_destination == '1' else stats_destination)
+
+# Startup check: run with --startup-check to open the window, report the time it took and quit,
+# with exit status 1 if that was over FIRST_WINDOW_BUDGET_SECONDS
+startup_check = '--startup-check' in sys.argv
 
 
 # Functions for mediating between fractal object and GUI
@@ -30,14 +46,111 @@ def button_color(fractal, residue):
     else:
         return black_button
 
-def generate_preview_images():
-    "Saves preview images to root directory"
-    preview_gradient = fractal.gradient_image(preview_render_size_from_modulus[fractal.modulus])
-    preview_gradient = preview_gradient.resize(preview_element_size, resample=Image.NEAREST)
-    preview_gradient.save('preview_gradient.png')
-    preview_bw = fractal.bw_image(preview_render_size_from_modulus[fractal.modulus])
-    preview_bw = preview_bw.resize(preview_element_size, resample=Image.NEAREST)
-    preview_bw.save('preview_bw.png')
+def generate_preview_images(fractal):
+    "Renders preview images in memory, returns PNG data as dictionary keyed by 'gradient' and 'bw'"
+    from PIL import Image
+    preview_images = {}
+    size = preview_render_size_from_modulus[fractal.modulus]
+    with fractal.stage('preview images', size):
+        for picture, img in [('gradient', fractal.gradient_image(size)), ('bw', fractal.bw_image(size))]:
+            img = img.resize(preview_element_size, resample=Image.NEAREST)
+            png_data = io.BytesIO()
+            img.save(png_data, format='PNG')
+            preview_images[picture] = png_data.getvalue()
+    return preview_images
+
+def random_candidate(fractal, symmetric):
+    "Returns a copy of fractal with random modulus, coefficients and black/white residues, as 'Randomize all' picks them"
+    candidate = fractal.copy()
+    candidate.modulus = random.randrange(2, MAX_MODULUS + 1)
+    for x in range(CA_SIZE):
+        for y in range(CA_SIZE):
+            candidate.coefficients[y][x] = random.randrange(candidate.modulus)
+            if symmetric and x > y:
+                candidate.coefficients[y][x] = candidate.coefficients[x][y]
+            # end if
+        # next y
+    # next x
+    candidate.coefficients[-1][-1] = 0
+    visible_white_residues = []
+    while not 0 < len(visible_white_residues) < candidate.modulus:
+        candidate.white_residues = [residue for residue in range(MAX_MODULUS) if random.choice([True, False])]
+        visible_white_residues = [residue for residue in candidate.white_residues if residue < candidate.modulus]
+    # end while loop, knowing that both colors show
+    return candidate
+
+def generate_gallery_images(candidates):
+    """
+    Renders black and white thumbnails of candidate Fractals, returns their PNG data in order.
+    Their residue arrays are computed together in one batched pass, at the largest preview size;
+    each thumbnail is then drawn at its own modulus's preview size from the residue cache.
+    """
+    from PIL import Image
+    size = max(preview_render_size_from_modulus[candidate.modulus] for candidate in candidates)
+    with fractal.stage('gallery', size, thumbnails=len(candidates)):
+        fr.batch_residue_arrays(candidates, size)
+        gallery_images = []
+        for candidate in candidates:
+            img = candidate.bw_image(preview_render_size_from_modulus[candidate.modulus])
+            img = img.resize(gallery_thumbnail_size, resample=Image.NEAREST)
+            png_data = io.BytesIO()
+            img.save(png_data, format='PNG')
+            gallery_images.append(png_data.getvalue())
+        # next candidate
+    return gallery_images
+
+def show_gallery(symmetric):
+    """
+    Opens a gallery of GALLERY_ROWS x GALLERY_COLUMNS random candidates, rendered on a worker thread.
+    Returns the candidate whose thumbnail is clicked, or None if the gallery is closed.
+    'Shuffle' replaces the candidates with new ones.
+    """
+    gallery_layout = [[sg.Image(size=gallery_thumbnail_size, enable_events=True, key=('gallery', row * GALLERY_COLUMNS + column))
+                       for column in range(GALLERY_COLUMNS)] for row in range(GALLERY_ROWS)]
+    gallery_layout += [[sg.Button('Shuffle', size_px=third_rect_px, pad=(0, 0)),
+                        sg.Button('Close', size_px=third_rect_px, pad=(0, 0))],
+                       [sg.Text('Rendering...', size_px=long_px, key='gallery status')]]
+    gallery_window = sg.Window('Cosmatesque gallery', gallery_layout).Finalize()
+
+    # The render thread can't touch the window, so thumbnails come back on gallery_events,
+    # polled every worker_poll_ms while a render is running
+    gallery_events = queue.Queue()
+
+    def render(generation, candidates):
+        gallery_events.put((generation, generate_gallery_images(candidates)))
+
+    generation = 0
+    candidates = None       # shown candidates, once their thumbnails are ready
+    pending = [random_candidate(fractal, symmetric) for _ in range(GALLERY_ROWS * GALLERY_COLUMNS)]
+    threading.Thread(target=render, args=(generation, pending), daemon=True).start()
+    chosen = None
+    while True:
+        if not gallery_events.empty():
+            event, gallery_values = 'gallery ready', {'gallery ready': gallery_events.get()}
+        elif candidates is pending:
+            event, gallery_values = gallery_window.read()
+        else:
+            event, gallery_values = gallery_window.read(timeout=worker_poll_ms)
+        if event in (None, 'Close'):
+            break
+        elif event == 'Shuffle':
+            generation += 1
+            pending = [random_candidate(fractal, symmetric) for _ in range(GALLERY_ROWS * GALLERY_COLUMNS)]
+            threading.Thread(target=render, args=(generation, pending), daemon=True).start()
+            gallery_window.Element('gallery status').Update('Rendering...')
+        elif event == 'gallery ready':
+            ready_generation, gallery_images = gallery_values['gallery ready']
+            if ready_generation == generation:      # drop thumbnails of candidates shuffled away
+                candidates = pending
+                for index, png_data in enumerate(gallery_images):
+                    gallery_window.Element(('gallery', index)).Update(data=png_data)
+                gallery_window.Element('gallery status').Update('Click a pattern to edit it')
+        elif isinstance(event, tuple) and event[0] == 'gallery' and candidates is not None:
+            chosen = candidates[event[1]]
+            break
+    # end while
+    gallery_window.close()
+    return chosen
 
 def auto_filename(picture):
     "Generates picture filename, sans .png. Argument picture should be 'bw' or 'gradient'"
@@ -49,6 +162,10 @@ def auto_filename(picture):
     )
     return filename
 
+def preview_key(fractal, picture):
+    "Identifies a preview in the preview cache"
+    return (fractal.summary(), picture, preview_render_size_from_modulus[fractal.modulus], preview_element_size)
+
 
 
 # GUI preview parameters
@@ -59,10 +176,14 @@ preview_render_size_from_modulus = {
     5: 125
 }
 preview_element_size = (450, 450)   # Fits 1360 x 768 laptop resolution
+preview_debounce_ms = 150           # wait for clicks to settle before rendering previews
+worker_poll_ms = 100                # how often the event loop checks on worker threads while they're busy
+gallery_thumbnail_size = (110, 110) # GALLERY_COLUMNS of these fit across the preview width
 
 
-# Initialize fractal with 3x3 array and Sierpinski triangle parameters + extra white residues
-fractal = fr.Fractal(
+# Initial parameters: 3x3 array and Sierpinski triangle parameters + extra white residues.
+# The window is laid out from these; the Fractal itself is made once the window is showing.
+initial_parameters = types.SimpleNamespace(
     modulus=2,
     coefficients=[
         [0, 0, 0],
@@ -72,9 +193,6 @@ fractal = fr.Fractal(
     white_residues=[1, 2, 3, 4]
 )
 
-# Initialize preview files
-generate_preview_images()
-
 # Initialize saved picture sizes
 saved_picture_size_per_modulus = {
     2: 1024,
@@ -119,7 +237,7 @@ black_white_event_keys = [('black/white', residue) for residue in range(MAX_MODU
 # GUI elements
 parameter_column = [[sg.Text('Recurrence coefficients')]]
 
-coefficient_column = [[sg.Button(fractal.coefficients[row][column], size_px=square_px, pad=(0,0), key=(row, column))
+coefficient_column = [[sg.Button(initial_parameters.coefficients[row][column], size_px=square_px, pad=(0,0), key=(row, column))
                       for column in range(CA_SIZE)] for row in range (CA_SIZE)]
 coefficient_column[-1][-1] = sg.Button('CURSOR', size_px=square_px, pad=(0,0), disabled=True)
 
@@ -132,17 +250,18 @@ coeff_manip_column = [[sg.Button('Clear', size_px=sq_half_px, pad=(0,0))],
 parameter_column += [[sg.Column(coefficient_column), sg.Column(coeff_manip_column, element_justification='center')],
                      [sg.Text('\n')],   # hacky empty space
                      [sg.Text('Modulus', size_px=half_px, pad=(0,0), justification='center'),
-                      sg.Button(fractal.modulus, size_px=half_px, pad=(0,0), key='modulus')],
+                      sg.Button(initial_parameters.modulus, size_px=half_px, pad=(0,0), key='modulus')],
                      [sg.Button('Apply to coefficients', size=long_px, pad=(0,0))],
                      [sg.Text('\n'+'Black/white residues')],
-                     [sg.Button(residue, size_px=square_px, pad=(0,0), button_color=button_color(fractal, residue),
-                                disabled=(residue >= fractal.modulus), key=('black/white', residue))
+                     [sg.Button(residue, size_px=square_px, pad=(0,0), button_color=button_color(initial_parameters, residue),
+                                disabled=(residue >= initial_parameters.modulus), key=('black/white', residue))
                      for residue in range(MAX_MODULUS)],
                      [sg.Button('Reverse', size_px=third_rect_px, pad=(0,0)),
                       sg.Button('Randomize', size_px=third_rect_px, pad=(0,0), key='randomize black/white'),
                       sg.Button('Default', size_px=third_rect_px, pad=(0,0), key='default black/white')],
                      [sg.Text('\n')],
                      [sg.Button('Randomize all', size_px=long_tall_px, pad=(0,0))],
+                     [sg.Button('Random gallery', size_px=long_px, pad=(0,0), key='gallery')],
                      [sg.Text('\n')],
                      [sg.Button('Sierpinski\ntriangle', size_px=presets_px, pad=(0,0), key='Sierpinski triangle'),
                       sg.Button('Sierpinski\ncarpet', size_px=presets_px, pad=(0,0), key='Sierpinski carpet'),
@@ -150,17 +269,17 @@ parameter_column += [[sg.Column(coefficient_column), sg.Column(coeff_manip_colum
                      ]
 
 gradient_column = [[sg.Text('Gradient image preview')],
-                   [sg.Image(filename='preview_gradient.png', key='preview_gradient')],
+                   [sg.Image(size=preview_element_size, key='preview_gradient')],     # filled in once rendered
                    [sg.Button('Save', size_px=save_px, pad=(0, 0), key='save gradient')],
                    [sg.Text('Filename:'),
-                    sg.Input(default_text=auto_filename('gradient'), size_px=text_entry_px, key='gradient filename')]
+                    sg.Input(default_text='', size_px=text_entry_px, key='gradient filename')]
                    ]
 
 bw_column = [[sg.Text('Black and white image preview')],
-             [sg.Image(filename='preview_bw.png', key='preview_bw')],
+             [sg.Image(size=preview_element_size, key='preview_bw')],
              [sg.Button('Save', size_px=save_px, pad=(0, 0), key='save bw')],
              [sg.Text('Filename:'),
-              sg.Input(default_text=auto_filename('bw'), size_px=text_entry_px, key='bw filename')]]
+              sg.Input(default_text='', size_px=text_entry_px, key='bw filename')]]
 
 saving_options_column_1 = [
     [sg.Checkbox('Automatic file names  (extension .png not shown)', default=True, enable_events=True, key='auto filename')],
@@ -174,13 +293,16 @@ saving_options_column_1 = [
 saving_options_column_2 = [
     [sg.Text('Saved picture size:'),
      sg.Text(
-         str(saved_picture_size_per_modulus[fractal.modulus])
+         str(saved_picture_size_per_modulus[initial_parameters.modulus])
          + ' x '
-         + str(saved_picture_size_per_modulus[fractal.modulus]),
+         + str(saved_picture_size_per_modulus[initial_parameters.modulus]),
          key='saved picture size')],
     [sg.Button('Smaller', size_px=third_rect_px, pad=(0, 0)),
      sg.Button('Larger', size_px=third_rect_px, pad=(0, 0))],
-    [sg.Text('Larger images will take longer to render.')]
+    [sg.Text('Larger images will take longer to render.')],
+    [sg.ProgressBar(100, orientation='h', size_px=long_px, key='save progress'),
+     sg.Button('Cancel', size_px=third_rect_px, pad=(0, 0), disabled=True, key='cancel save')],
+    [sg.Text('', size_px=long_px, key='save status')]
 ]
 
 path_column = [[sg.FolderBrowse('Save to', size=third_rect_px, pad=(0,0), target='directory'),
@@ -195,12 +317,112 @@ picture_column = [[sg.Column(gradient_column, element_justification='center'),
 layout = [[sg.Column(parameter_column, element_justification='center'),
            sg.Column(picture_column, element_justification='center')]]
 
-# Create the window
-window = sg.Window('Cosmatesque', layout, grab_anywhere=True)
+# Create and show the window
+window = sg.Window('Cosmatesque', layout, grab_anywhere=True).Finalize()
+first_window_seconds = time.perf_counter() - startup_time
+if first_window_seconds > FIRST_WINDOW_BUDGET_SECONDS:
+    logging.warning('Window took %.2f s to appear, over the %.1f s budget', first_window_seconds,
+                    FIRST_WINDOW_BUDGET_SECONDS)
+if startup_check:
+    print('First window after', round(first_window_seconds, 3), 's')
+    window.close()
+    sys.exit(1 if first_window_seconds > FIRST_WINDOW_BUDGET_SECONDS else 0)
+
+# Now load the renderer and make the Fractal
+import fractal as fr
+import store
+
+fractal = fr.Fractal(
+    modulus=initial_parameters.modulus,
+    coefficients=[list(row) for row in initial_parameters.coefficients],
+    white_residues=list(initial_parameters.white_residues),
+    store=store.ResidueStore(),     # reuse residue arrays computed in earlier sessions
+    observer=fr.log_stage if stats_destination else None,
+    workers=None    # large saves spread across every core; previews are too small to (see PARALLEL_SIZE)
+)
+if stats_destination:
+    fr.log_stage({'stage': 'first window', 'wall_seconds': first_window_seconds})
+window.Element('gradient filename').Update(auto_filename('gradient'))
+window.Element('bw filename').Update(auto_filename('bw'))
+
+# Previews seen before, the startup one above all, are shown from the cache rather than rendered
+preview_cache = store.PreviewCache()
+
+
+# Worker threads can't touch the window, so they report (event, payload) pairs on worker_events,
+# which the event loop takes up in place of window events, polling every worker_poll_ms while
+# any worker is busy.
+worker_events = queue.Queue()
+
+# Saves run one at a time on a worker thread so the window stays live while they render.
+# Each queued save carries its own copy of the parameters, so editing can continue meanwhile.
+save_queue = queue.Queue()
+cancel_save = threading.Event()
+pending_saves = 0
+
+def save_worker():
+    "Renders queued saves, reporting to the event loop with 'save ...' events"
+    while True:
+        job = save_queue.get()
+        cancel_save.clear()
+        worker_events.put(('save started', job))
+
+        def report_progress(rows_done, rows_total):
+            if cancel_save.is_set():
+                raise fr.RenderCancelled
+            if rows_done:   # no rows yet are the residue stage's checkpoints, only here for Cancel
+                worker_events.put(('save progress', (job, rows_done / rows_total)))
+
+        try:
+            job['fractal'].save_image(job['path and filename'], job['picture'], job['size'], progress=report_progress)
+        except fr.RenderCancelled:
+            worker_events.put(('save cancelled', job))
+        except Exception:
+            worker_events.put(('save failed', job))
+        else:
+            worker_events.put(('save finished', job))
+
+threading.Thread(target=save_worker, daemon=True).start()
+
+
+# Previews render on their own worker thread.  Each parameter change bumps preview_generation;
+# a render is requested once no change has come for preview_debounce_ms, and renders or results
+# belonging to an older generation are dropped.  Finished previews come back on worker_events.
+preview_requests = queue.Queue()
+preview_generation = 0
+preview_due = time.monotonic()      # when to request a preview, if one is waiting; the first right away
+preview_awaited = None              # generation the worker is rendering, until its previews are shown
+
+def preview_worker():
+    "Renders the newest requested previews, reporting them to the event loop as 'preview ready'"
+    while True:
+        generation, preview_fractal = preview_requests.get()
+        while not preview_requests.empty():
+            generation, preview_fractal = preview_requests.get()
+        if generation != preview_generation:
+            continue
+        preview_images = generate_preview_images(preview_fractal)
+        for picture, png_data in preview_images.items():
+            preview_cache.put(preview_key(preview_fractal, picture), png_data)
+        worker_events.put(('preview ready', (generation, preview_images)))
+
+threading.Thread(target=preview_worker, daemon=True).start()
 
 # Event loop
 while True:
-    event, values = window.read()
+    if not worker_events.empty():
+        event, payload = worker_events.get()
+        values = {event: payload}
+    else:
+        timeout = None
+        if preview_due is not None:
+            timeout = max(0, int(1000 * (preview_due - time.monotonic())))
+        if pending_saves or preview_awaited is not None:
+            timeout = worker_poll_ms if timeout is None else min(timeout, worker_poll_ms)
+        if timeout is None:
+            event, values = window.read()
+        else:
+            event, values = window.read(timeout=timeout)
     # print(event, values)  # Enable for debugging
 
     # First few functions handle visible changes to GUI
@@ -228,10 +450,8 @@ while True:
             window.Element(('black/white', residue)).Update(residue, button_color=button_color(fractal, residue),
                                                             disabled=(residue >= fractal.modulus))
 
-        # Refresh previews
-        generate_preview_images()
-        window.Element('preview_gradient').Update(filename='preview_gradient.png')
-        window.Element('preview_bw').Update(filename='preview_bw.png')
+        # Refresh previews once clicks settle
+        request_previews()
 
         # Refresh displayed picture size
         window.Element('saved picture size').Update(str(saved_picture_size_per_modulus[fractal.modulus])
@@ -246,6 +466,20 @@ while True:
             window.Element('gradient filename').Update('')
             window.Element('bw filename').Update('')
 
+    def request_previews():
+        "Marks previews out of date, and schedules a render after the debounce interval"
+        global preview_generation, preview_due
+        preview_generation += 1
+        preview_due = time.monotonic() + preview_debounce_ms / 1000
+
+    def show_previews(generation, preview_images):
+        "Displays rendered previews unless newer parameters have arrived since"
+        global preview_awaited
+        if generation == preview_generation:
+            preview_awaited = None
+            window.Element('preview_gradient').Update(data=preview_images['gradient'])
+            window.Element('preview_bw').Update(data=preview_images['bw'])
+
     def refresh_picture_size():
         "Refresh the to-be-generated picture size without updating all preview-related elements"
         window.Element('saved picture size').Update(str(saved_picture_size_per_modulus[fractal.modulus])
@@ -366,19 +600,40 @@ while True:
         if saved_picture_size_per_modulus[fractal.modulus] > 1:
             saved_picture_size_per_modulus[fractal.modulus] //= fractal.modulus
 
-    def save_gradient():
-        window.Element('save gradient').Update('Working...')  # Why delayed on Mac?
-        window.refresh()
-        gradient_image = fractal.gradient_image(saved_picture_size_per_modulus[fractal.modulus])
-        try:
-            filename = values['gradient filename'] + '.png'
-            path_and_filename = os.path.join(values['path'], filename)
-            gradient_image.save(fp=path_and_filename)
-        except:
-            sg.popup("Error. Please check filename and directory.", keep_on_top=True)
+    def save_picture(picture):
+        "Queues a save of the 'bw' or 'gradient' picture with the current parameters"
+        global pending_saves
+        filename = values[picture + ' filename'] + '.png'
+        save_queue.put({
+            'fractal': fractal.copy(),
+            'picture': picture,
+            'size': saved_picture_size_per_modulus[fractal.modulus],
+            'path and filename': os.path.join(values['path'], filename),
+            'open after save': values['open after save']
+        })
+        pending_saves += 1
+        refresh_save_status()
+
+    def refresh_save_status():
+        "Shows how many saves are rendering or waiting, and enables Cancel while one is running"
+        if pending_saves == 0:
+            window.Element('save status').Update('')
+            window.Element('save progress').UpdateBar(0)
         else:
+            window.Element('save status').Update('Saving... (' + str(pending_saves) + ' in queue)')
+        window.Element('cancel save').Update(disabled=(pending_saves == 0))
+
+    def finish_save(job, outcome):
+        "Reports a save that has ended: 'finished', 'failed' or 'cancelled'"
+        global pending_saves
+        pending_saves -= 1
+        refresh_save_status()
+        if outcome == 'failed':
+            sg.popup("Error. Please check filename and directory.", keep_on_top=True)
+        elif outcome == 'finished':
             # Success!
-            if values['open after save']:
+            path_and_filename = job['path and filename']
+            if job['open after save']:
                 if sys.platform == 'win32':
                     os.startfile(path_and_filename)
                 else:
@@ -386,29 +641,6 @@ while True:
                     subprocess.call([opener, path_and_filename])
             else:
                 sg.popup("Saved!", no_titlebar=True, keep_on_top=True)
-        window.Element('save gradient').Update('Save')
-
-    def save_bw():
-        window.Element('save bw').Update('Working...')
-        window.refresh()
-        gradient_image = fractal.bw_image(saved_picture_size_per_modulus[fractal.modulus])
-        try:
-            filename = values['bw filename'] + '.png'
-            path_and_filename = os.path.join(values['path'], filename)
-            gradient_image.save(fp=path_and_filename)
-        except:
-            sg.popup("Error. Please check filename and directory.", keep_on_top=True)
-        else:
-            # Success!
-            if values['open after save']:
-                if sys.platform == "win32":
-                    os.startfile(path_and_filename)
-                else:
-                    opener = "open" if sys.platform == "darwin" else "xdg-open" #
-                    subprocess.call([opener, path_and_filename])
-            else:
-                sg.popup("Saved!", no_titlebar=True, keep_on_top=True)
-        window.Element('save bw').Update('Save')
 
     def change_directory():
         window.Element('save folder').Update(str(values['path']))
@@ -448,6 +680,13 @@ while True:
         randomize_coefficients()
         randomize_black_white()
         refresh_display()
+    elif event == 'gallery':
+        chosen = show_gallery(values['randomize symmetrically'])
+        if chosen is not None:
+            fractal.modulus = chosen.modulus
+            fractal.coefficients = chosen.coefficients
+            fractal.white_residues = chosen.white_residues
+            refresh_display()
     elif event == 'Sierpinski triangle':
         sierpinski_triangle()
         refresh_display()
@@ -468,11 +707,35 @@ while True:
         refresh_picture_size()
         refresh_filename()
     elif event == 'save gradient':
-        save_gradient()
+        save_picture('gradient')
     elif event == 'save bw':
-        save_bw()
+        save_picture('bw')
+    elif event == 'cancel save':
+        cancel_save.set()
+    elif event == 'save started':
+        window.Element('save progress').UpdateBar(0)
+    elif event == 'save progress':
+        window.Element('save progress').UpdateBar(int(100 * values['save progress'][1]))
+    elif event == 'save finished':
+        finish_save(values['save finished'], 'finished')
+    elif event == 'save failed':
+        finish_save(values['save failed'], 'failed')
+    elif event == 'save cancelled':
+        finish_save(values['save cancelled'], 'cancelled')
     elif event == 'path':
         change_directory()
+    elif event == 'preview ready':
+        show_previews(*values['preview ready'])
+
+    # Request previews once the debounce interval has passed with no further changes
+    if preview_due is not None and time.monotonic() >= preview_due:
+        cached_previews = {picture: preview_cache.get(preview_key(fractal, picture)) for picture in ('gradient', 'bw')}
+        if None in cached_previews.values():
+            preview_requests.put((preview_generation, fractal.copy()))
+            preview_awaited = preview_generation
+        else:
+            show_previews(preview_generation, cached_previews)
+        preview_due = None
 # end while
 
 window.close()
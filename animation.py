@@ -0,0 +1,178 @@
+import argparse
+import ast
+import collections
+import concurrent.futures
+import os
+import numpy as np
+from PIL import Image
+import encoders
+import fractal as fr
+
+# Exports animations built on Fractal, as animated PNG (streamed a frame at a time) or GIF:
+#
+#   growth: the top-left square grows through powers of the modulus, each frame scaled up to the
+#     same size.  The largest residue array is computed once and every frame sliced from it.
+#   morph: one frame per parameter set, all at the same size.
+#
+# Example, from the command line:
+#
+#   python animation.py growth --coefficients "[[0, 1], [1]]" --modulus 3 --levels 6 --output growth.png
+#   python animation.py morph --parameters "[([[0, 1], [1]], 2, [1]), ([[1, 1], [1]], 3, [1, 2])]" --output morph.png
+
+
+DEFAULT_FRAME_SIZE = 729
+DEFAULT_DELAY_MS = 500
+
+
+def frame_format(fractal, picture):
+    """
+    Returns (bit_depth, palette) shared by every frame of an animation of picture: 1-bit gray for
+    bw, and for gradient 256 entries of gradient_colors, so frames of any depth can share them
+    """
+    if picture == 'bw':
+        return 1, None
+    return 8, fractal.gradient_colors(256)
+
+
+def frame_levels(fractal, picture, size, bw_base=None):
+    """
+    Returns the size x size frame of pixel values for frame_format: black/white, or the gradient
+    spread over 0 to 255.  bw_base, if given, is a black and white array at least size square to
+    slice the frame from, as Fractal.gradient_levels takes.
+    """
+    if picture == 'bw':
+        return fractal.bw_levels(size) if bw_base is None else bw_base[:size, :size]
+    depth = max(fractal.depth(size), 1)
+    return (fractal.gradient_levels(size, bw_base).astype(np.uint16) * 255 // depth).astype(np.uint8)
+
+
+def scale(frame, frame_size):
+    "Scales a square frame to frame_size x frame_size, nearest neighbor"
+    if frame.shape[0] == frame_size:
+        return frame
+    indices = np.arange(frame_size) * frame.shape[0] // frame_size
+    return frame[indices][:, indices]
+
+
+def growth_frames(fractal, picture='bw', levels=6, frame_size=DEFAULT_FRAME_SIZE):
+    """
+    Yields frames showing the top-left modulus ^ k square for k = 1 to levels, each scaled to
+    frame_size.  The modulus ^ levels residue array is computed and classified once up front, and
+    each smaller frame sliced from that, even when the array is too large to stay in the cache.
+    """
+    bw_base = fractal.classify(fractal.residue_array(fractal.modulus ** levels))
+    for k in range(1, levels + 1):
+        yield scale(frame_levels(fractal, picture, fractal.modulus ** k, bw_base), frame_size)
+    # next k
+
+
+def morph_frames(fractal, parameter_sets, picture='bw', size=DEFAULT_FRAME_SIZE):
+    "Yields a size x size frame for each (coefficients, modulus, white_residues) in parameter_sets"
+    for coefficients, modulus, white_residues in parameter_sets:
+        frame_fractal = fractal.copy()
+        frame_fractal.coefficients = [list(row) for row in coefficients]
+        frame_fractal.coefficients[-1].append(0)     # square-minus-a-corner, as for make_image
+        frame_fractal.modulus = modulus
+        frame_fractal.white_residues = list(white_residues)
+        yield frame_levels(frame_fractal, picture, size)
+    # next parameter set
+
+
+def save_animation(filename, frames, frame_count, frame_size, bit_depth=8, palette=None, delay_ms=DEFAULT_DELAY_MS,
+                   loops=0, compress_level=6, workers=None, progress=None):
+    """
+    Saves frame_count frames (frame_size x frame_size arrays, from an iterable such as
+    growth_frames) as an animation: GIF if filename ends in .gif, otherwise animated PNG.
+    APNG frames are compressed on workers threads (default: one per core) while later frames
+    render, and written in order as they finish, holding only a few frames in memory at a time.
+    Pillow's GIF writer keeps every frame until the end.
+    If given, progress(frames_done, frame_count) is called after each frame.
+    """
+    if filename.lower().endswith('.gif'):
+        def images():
+            for frame in frames:
+                img = Image.frombytes('P', (frame_size, frame_size), np.ascontiguousarray(frame, dtype=np.uint8).tobytes())
+                img.putpalette([value for color in (palette or encoders.gray_palette(2 ** bit_depth)) for value in color])
+                yield img
+            # next frame
+        images = images()
+        next(images).save(filename, save_all=True, append_images=images, duration=delay_ms, loop=loops)
+        if progress:
+            progress(frame_count, frame_count)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with encoders.APNGWriter(filename, frame_size, frame_size, frame_count, delay_ms, loops, compress_level,
+                             bit_depth, palette) as writer, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for frame in frames:
+            pending.append(pool.submit(encoders.compress_frame, frame, bit_depth, compress_level))
+            # Keep a couple of frames per worker in flight, writing out the oldest as it finishes
+            while len(pending) > 2 * workers or (pending and pending[0].done()):
+                writer.write_compressed_frame(pending.popleft().result())
+                if progress:
+                    progress(writer.frames_written, frame_count)
+            # end while
+        # next frame
+        while pending:
+            writer.write_compressed_frame(pending.popleft().result())
+            if progress:
+                progress(writer.frames_written, frame_count)
+        # end while
+
+
+def growth_animation(fractal, filename, picture='bw', levels=6, frame_size=DEFAULT_FRAME_SIZE, **options):
+    "Saves a growth animation of fractal through levels powers of its modulus; options go to save_animation"
+    bit_depth, palette = frame_format(fractal, picture)
+    save_animation(filename, growth_frames(fractal, picture, levels, frame_size), levels, frame_size, bit_depth,
+                   palette, **options)
+
+
+def morph_animation(fractal, filename, parameter_sets, picture='bw', size=DEFAULT_FRAME_SIZE, **options):
+    """
+    Saves an animation with a frame for each (coefficients, modulus, white_residues) in parameter_sets,
+    coefficients square-minus-a-corner as for make_image.  fractal supplies the cache, store and
+    colors.  options go to save_animation.
+    """
+    bit_depth, palette = frame_format(fractal, picture)
+    save_animation(filename, morph_frames(fractal, parameter_sets, picture, size), len(parameter_sets), size,
+                   bit_depth, palette, **options)
+
+
+def main(arguments=None):
+    "Command line entry point; run python animation.py --help for options"
+    parser = argparse.ArgumentParser(description='Export Cosmatesque animations as animated PNG or GIF.')
+    parser.add_argument('kind', choices=['growth', 'morph'])
+    parser.add_argument('--coefficients', type=ast.literal_eval, default=[[0, 1], [1]],
+                        help='square-minus-a-corner coefficient array, for growth')
+    parser.add_argument('--modulus', type=int, default=2, help='for growth')
+    parser.add_argument('--white-residues', type=ast.literal_eval, default=[1], help='for growth')
+    parser.add_argument('--levels', type=int, default=6, help='growth frames: powers of the modulus')
+    parser.add_argument('--parameters', type=ast.literal_eval, default=[],
+                        help='for morph: list of (coefficients, modulus, white_residues)')
+    parser.add_argument('--picture', choices=['bw', 'gradient'], default='bw')
+    parser.add_argument('--size', type=int, default=DEFAULT_FRAME_SIZE, help='frame width and height')
+    parser.add_argument('--delay', type=int, default=DEFAULT_DELAY_MS, help='milliseconds per frame')
+    parser.add_argument('--workers', type=int, default=None, help='compression threads (default: one per core)')
+    parser.add_argument('--output', default='animation.png', help='.png for animated PNG, .gif for GIF')
+    args = parser.parse_args(arguments)
+
+    def report(done, total):
+        print(str(done) + ' / ' + str(total) + ' frames', end='\r', flush=True)
+
+    options = {'delay_ms': args.delay, 'workers': args.workers, 'progress': report}
+    if args.kind == 'growth':
+        coefficients = [list(row) for row in args.coefficients]
+        coefficients[-1].append(0)
+        fractal = fr.Fractal(coefficients=coefficients, modulus=args.modulus, white_residues=args.white_residues)
+        growth_animation(fractal, args.output, args.picture, args.levels, args.size, **options)
+    else:
+        morph_animation(fr.Fractal(), args.output, args.parameters, args.picture, args.size, **options)
+    print()
+    print('Saved', args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
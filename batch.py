@@ -0,0 +1,162 @@
+import argparse
+import ast
+import concurrent.futures
+import copy
+import itertools
+import json
+import os
+import fractal as fr
+
+# Renders make_image pictures for every combination in a grid of parameters, in parallel.
+# Progress is checkpointed to a manifest in the output directory, so an interrupted run picks up
+# where it left off.  Example, from the command line:
+#
+#   python batch.py --coefficients "[[[0, 1], [0, 1]], [[0, 1]]]" --moduli 2 3 5 \
+#       --white-residues "[[0], [1, 2, 3, 4]]" --pictures bw gradient --sizes 729 --workers 8 --output renders
+
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def expand_coefficients(template):
+    """
+    Lists every coefficient array allowed by template, a square-minus-a-corner array (as for
+    make_image) whose entries are either numbers or lists/ranges of numbers to choose from.
+    """
+    row_lengths = [len(row) for row in template]
+    choices = [list(entry) if isinstance(entry, (list, tuple, range)) else [entry]
+               for row in template for entry in row]
+
+    arrays = []
+    for entries in itertools.product(*choices):
+        rows = []
+        position = 0
+        for length in row_lengths:
+            rows.append(list(entries[position:position + length]))
+            position += length
+        # next row
+        arrays.append(rows)
+    # next combination
+    return arrays
+
+
+def parameter_grid(coefficients=[[0, 1], [1]], moduli=[2], white_residues=[[1]], pictures=['bw'], sizes=[1024]):
+    "Lists make_image keyword arguments for every combination of the given choices"
+    return [
+        {'coefficients': array, 'modulus': modulus, 'white_residues': list(residues),
+         'picture': picture, 'size': size}
+        for array in expand_coefficients(coefficients)
+        for modulus in moduli
+        for residues in white_residues
+        for picture in pictures
+        for size in sizes
+    ]
+
+
+def job_key(job):
+    "Identifies a job in the manifest"
+    return json.dumps(job, sort_keys=True)
+
+
+def load_manifest(directory):
+    "Reads the manifest in directory, or returns an empty one"
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {'jobs': {}}
+
+
+def save_manifest(directory, manifest):
+    "Writes the manifest atomically, so an interrupted run never leaves it half-written"
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def render_job(job, directory):
+    "Renders one job in a worker process, returns the saved filename"
+    # make_image appends to the coefficient array, so hand it a copy
+    return fr.make_image(directory=directory, **copy.deepcopy(job))
+
+
+def render_batch(jobs, directory='.', workers=None, progress=None):
+    """
+    Renders jobs (make_image keyword dictionaries, as from parameter_grid) into directory across
+    at most workers processes (default: one per core).  Jobs already marked done in the
+    directory's manifest, with their file still present, are skipped; failed jobs are retried.
+    If given, progress(done, total) is called after each job.  Returns the manifest.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = load_manifest(directory)
+
+    def is_done(job):
+        entry = manifest['jobs'].get(job_key(job))
+        return entry is not None and entry['status'] == 'done' and os.path.exists(entry['filename'])
+
+    remaining = [job for job in jobs if not is_done(job)]
+    done = len(jobs) - len(remaining)
+    if progress:
+        progress(done, len(jobs))
+
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # Keep only a couple of jobs per worker queued, rather than submitting thousands up front
+        window = 2 * workers
+        pending = {}
+        remaining = iter(remaining)
+        while True:
+            for job in itertools.islice(remaining, window - len(pending)):
+                pending[executor.submit(render_job, job, directory)] = job
+            if not pending:
+                break
+
+            finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                job = pending.pop(future)
+                try:
+                    entry = {'status': 'done', 'filename': future.result()}
+                except Exception as error:
+                    entry = {'status': 'failed', 'error': repr(error)}
+                entry['job'] = job
+                manifest['jobs'][job_key(job)] = entry
+                done += 1
+            # next finished job
+            save_manifest(directory, manifest)
+            if progress:
+                progress(done, len(jobs))
+        # end while
+
+    return manifest
+
+
+def main(arguments=None):
+    "Command line entry point; run python batch.py --help for options"
+    parser = argparse.ArgumentParser(description='Render Cosmatesque images for a grid of parameters.')
+    parser.add_argument('--coefficients', type=ast.literal_eval, default=[[0, 1], [1]],
+                        help='square-minus-a-corner coefficient array; entries may be lists of choices')
+    parser.add_argument('--moduli', type=int, nargs='+', default=[2])
+    parser.add_argument('--white-residues', type=ast.literal_eval, default=[[1]],
+                        help='list of white residue lists')
+    parser.add_argument('--pictures', nargs='+', choices=['bw', 'gradient', 'residues'], default=['bw'])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1024])
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--output', default='.', help='output directory, also holding the manifest')
+    args = parser.parse_args(arguments)
+
+    jobs = parameter_grid(args.coefficients, args.moduli, args.white_residues, args.pictures, args.sizes)
+
+    def report(done, total):
+        print(str(done) + ' / ' + str(total) + ' images', end='\r', flush=True)
+
+    manifest = render_batch(jobs, args.output, args.workers, progress=report)
+    print()
+    failures = [entry for entry in manifest['jobs'].values() if entry['status'] == 'failed']
+    for entry in failures:
+        print('Failed:', entry['job'], entry['error'])
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
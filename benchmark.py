@@ -0,0 +1,227 @@
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import numpy as np
+import PIL
+from PIL import Image
+import encoders
+import fractal as fr
+
+# Times each stage of the rendering pipeline over a matrix of parameters and sizes, records peak
+# memory, saves the results as JSON and compares them with a baseline run.  Example:
+#
+#   python benchmark.py --output new.json --baseline baseline.json
+#
+# exits with status 1 if any stage got slower than the baseline by more than the tolerance.
+
+
+# Sizes the GUI renders: previews (as preview_render_size_from_modulus in Cosmatesque.py) and
+# default saved pictures (as saved_picture_size_per_modulus)
+PREVIEW_SIZES = {2: 128, 3: 81, 4: 128, 5: 125}
+SAVED_SIZES = {2: 1024, 3: 729, 4: 1024, 5: 625}
+PREVIEW_ELEMENT_SIZE = (450, 450)
+
+PRESETS = {
+    'Sierpinski triangle': ([[0, 0, 0], [0, 0, 1], [0, 1, 0]], 2),
+    'Sierpinski carpet': ([[0, 0, 0], [0, 1, 1], [0, 1, 0]], 3),
+    "Fredkin's replicator": ([[1, 1, 1], [1, 0, 1], [1, 1, 0]], 2),
+}
+MODULI = [2, 3, 4, 5]
+REACHES = [2, 3, 4, 5]
+
+DEFAULT_TOLERANCE = 0.25    # fractional slowdown tolerated before a stage counts as a regression
+MIN_SLOWDOWN_SECONDS = 0.005    # smaller slowdowns are timer noise, whatever the ratio
+
+
+def cases(quick=False):
+    """
+    Lists (name, coefficients, modulus, sizes) for each benchmark case: the presets, then a random
+    but reproducible coefficient array for every reach and modulus.
+    """
+    generator = random.Random(0)
+    matrix = []
+    for name, (coefficients, modulus) in PRESETS.items():
+        matrix.append((name, coefficients, modulus, [PREVIEW_SIZES[modulus], SAVED_SIZES[modulus]]))
+    for reach in REACHES:
+        for modulus in MODULI:
+            coefficients = [[generator.randrange(modulus) for x in range(reach)] for y in range(reach)]
+            coefficients[-1][-1] = 0
+            sizes = [PREVIEW_SIZES[modulus]] if quick else [PREVIEW_SIZES[modulus], SAVED_SIZES[modulus]]
+            matrix.append(('reach ' + str(reach) + ', modulus ' + str(modulus), coefficients, modulus, sizes))
+    return matrix
+
+
+def measure(setup, repeat):
+    """
+    Times repeat runs of a stage, each prepared afresh by setup (as from stages), and returns
+    (best wall seconds, best CPU seconds, peak bytes allocated during one more traced run).
+    """
+    wall_times = []
+    cpu_times = []
+    for _ in range(repeat):
+        run = setup()
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        run()
+        cpu_times.append(time.process_time() - cpu_start)
+        wall_times.append(time.perf_counter() - wall_start)
+    # next repeat
+
+    # Measure memory separately: tracing slows allocation-heavy code down
+    run = setup()
+    tracemalloc.start()
+    run()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return min(wall_times), min(cpu_times), peak_bytes
+
+
+def stages(coefficients, modulus, size):
+    """
+    Returns the pipeline stages for one case as a dictionary from stage name to a setup function.
+    Each setup prepares a fresh Fractal (so earlier runs can't be served from its cache) and
+    returns the function to time.  Image stages start with residues already cached, so each
+    stage is timed on its own.
+    """
+    def fresh(warm=False):
+        fractal = fr.Fractal(coefficients=[list(row) for row in coefficients], modulus=modulus,
+                             white_residues=[0])
+        if warm:
+            fractal.residue_array(size)
+        return fractal
+
+    def residue_array():
+        fractal = fresh()
+        return lambda: fractal.residue_array(size)
+
+    def bw_image():
+        fractal = fresh(warm=True)
+        return lambda: fractal.bw_image(size)
+
+    def gradient_image():
+        fractal = fresh(warm=True)
+        return lambda: fractal.gradient_image(size)
+
+    def encoding(picture):
+        # As save_image encodes a picture not streamed: levels at pixel_format, written a band at a time
+        def setup():
+            fractal = fresh()
+            levels = fractal.bw_levels(size) if picture == 'bw' else fractal.gradient_levels(size)
+            bit_depth, palette = fractal.pixel_format(picture, size)
+
+            def run():
+                with encoders.PNGWriter(os.devnull, size, size, 6, bit_depth, palette) as writer:
+                    for y0 in range(0, size, fr.DEFAULT_BAND_HEIGHT):
+                        writer.write_rows(levels[y0:y0 + fr.DEFAULT_BAND_HEIGHT])
+                    # next band
+            return run
+        return setup
+
+    def preview_images():
+        # As generate_preview_images in Cosmatesque.py, from a cold cache as after a click
+        fractal = fresh()
+        preview_size = PREVIEW_SIZES.get(modulus, size)
+
+        def run():
+            for img in [fractal.gradient_image(preview_size), fractal.bw_image(preview_size)]:
+                img.resize(PREVIEW_ELEMENT_SIZE, resample=Image.NEAREST).save(io.BytesIO(), format='PNG')
+        return run
+
+    return {
+        'residue_array': residue_array,
+        'bw_image': bw_image,
+        'gradient_image': gradient_image,
+        'png_encoding': encoding('bw'),
+        'gradient_encoding': encoding('gradient'),
+        'preview_images': preview_images,
+    }
+
+
+def run_benchmarks(quick=False, repeat=3, progress=None):
+    "Runs every stage of every case, returns the results dictionary that gets saved as JSON"
+    results = []
+    for name, coefficients, modulus, sizes in cases(quick):
+        for size in sizes:
+            for stage, setup in stages(coefficients, modulus, size).items():
+                if stage == 'preview_images' and size != PREVIEW_SIZES[modulus]:
+                    continue    # previews only have one size
+                wall_seconds, cpu_seconds, peak_bytes = measure(setup, repeat)
+                results.append({
+                    'case': name, 'coefficients': coefficients, 'modulus': modulus, 'size': size,
+                    'stage': stage, 'wall_seconds': wall_seconds, 'cpu_seconds': cpu_seconds,
+                    'peak_bytes': peak_bytes,
+                })
+                if progress:
+                    progress(results[-1])
+            # next stage
+        # next size
+    # next case
+
+    return {
+        'environment': {
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+        },
+        'results': results,
+    }
+
+
+def result_key(result):
+    return (result['case'], result['size'], result['stage'])
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    "Lists results slower than the matching baseline result by more than tolerance, with the ratio"
+    baseline_times = {result_key(result): result['wall_seconds'] for result in baseline['results']}
+    regressions = []
+    for result in results['results']:
+        old_seconds = baseline_times.get(result_key(result))
+        if (old_seconds and result['wall_seconds'] > old_seconds * (1 + tolerance)
+                and result['wall_seconds'] - old_seconds > MIN_SLOWDOWN_SECONDS):
+            regressions.append((result, result['wall_seconds'] / old_seconds))
+    return regressions
+
+
+def main(arguments=None):
+    "Command line entry point; run python benchmark.py --help for options"
+    parser = argparse.ArgumentParser(description='Benchmark the Cosmatesque rendering pipeline.')
+    parser.add_argument('--output', default='benchmark_results.json', help='where to save results as JSON')
+    parser.add_argument('--baseline', help='earlier results to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='fractional slowdown tolerated before flagging a regression')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per stage; the best is kept')
+    parser.add_argument('--quick', action='store_true', help='preview sizes only for the reach/modulus matrix')
+    args = parser.parse_args(arguments)
+
+    def report(result):
+        print('{case:>22}  {size:>5}  {stage:<17} {wall_seconds:9.4f} s  {peak_mb:8.1f} MB'.format(
+            peak_mb=result['peak_bytes'] / 2 ** 20, **result))
+
+    results = run_benchmarks(args.quick, args.repeat, progress=report)
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=1)
+    print('Saved results to', args.output)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for result, ratio in regressions:
+            print('REGRESSION {case}, size {size}, {stage}: {ratio:.2f}x slower'.format(ratio=ratio, **result))
+        if regressions:
+            return 1
+        print('No regressions against', args.baseline)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,104 @@
+import numpy as np
+
+# Bit-parallel engine for modulus 2, where the recurrence is an exclusive or of shifted neighbors.
+# Each row is one Python integer holding a bit per cell, laid out as a 1-bit PNG or TIFF row is:
+# cell x of a row padded to a whole number of bytes, nbits long, is bit nbits - 1 - x, so
+#
+#   row.to_bytes(nbits // 8, 'big')
+#
+# is the row ready for the image encoder, first cell in the highest bit.  A tap (dx, dy) then
+# reads row y - dy shifted right by dx, and a whole row costs a few shifts and exclusive ors
+# per nonzero coefficient, each handling 64 cells per machine word.  Cells past the width, in the
+# low padding bits, come out as the true residues beyond the picture's edge; packed() clears them.
+
+
+def padded_bits(width):
+    "Bits in a row of width cells, padded to whole bytes"
+    return -(-width // 8) * 8
+
+
+def split_taps(taps):
+    """
+    Sorts taps (dx, dy, weight) with odd weights, the only ones that count modulo 2, into those
+    reading earlier rows, as (dx, dy), and the shifts dx of those reading the same row
+    """
+    above = [(dx, dy) for dx, dy, weight in taps if weight % 2 and dy > 0]
+    same_row = [dx for dx, dy, weight in taps if weight % 2 and dy == 0]
+    return above, same_row
+
+
+def solve_row(row, same_row, nbits):
+    """
+    Finishes a row given row, the exclusive or of everything from earlier rows: the residues r
+    satisfy r = row + Q(r), where Q shifts right by each dx in same_row, so r = row / (1 - Q).
+    Modulo 2, 1 / (1 - Q) is the product over i of (1 + Q applied with every shift times 2 ^ i),
+    and the factors run out once the smallest shift passes nbits: about log2(nbits) rounds.
+    """
+    if not same_row:
+        return row
+    scale = 0
+    while min(same_row) << scale < nbits:
+        shifted = row
+        for dx in same_row:
+            shifted ^= row >> (dx << scale)
+        # next shift
+        row = shifted
+        scale += 1
+    # end while
+    return row
+
+
+def packed_rows(taps, width, height, above=None, origin=True):
+    """
+    Yields height rows of residues modulo 2, each an integer laid out as described above.
+    above lists the rows just before the first, oldest first, as far back as the taps reach
+    (missing ones read zero); origin is whether the first row holds the initial 1 at cell 0.
+    """
+    nbits = padded_bits(width)
+    above_taps, same_row = split_taps(taps)
+    reach = max([dy for dx, dy in above_taps] + [1])
+    rows = ([0] * reach + list(above or []))[-reach:]
+    for y in range(height):
+        row = 1 << (nbits - 1) if origin and y == 0 else 0
+        for dx, dy in above_taps:
+            row ^= rows[-dy] >> dx
+        # next tap
+        row = solve_row(row, same_row, nbits)
+        rows.append(row)
+        del rows[0]
+        yield row
+    # next y
+
+
+def packed(row, width):
+    "Returns a row integer as uint8 bytes, 1-bit image layout, with the padding bits past width cleared"
+    nbits = padded_bits(width)
+    row &= ~((1 << (nbits - width)) - 1)
+    return np.frombuffer(row.to_bytes(nbits // 8, 'big'), dtype=np.uint8)
+
+
+def pack(cells):
+    "Returns the row integer of a 1D array of residues modulo 2, the inverse of unpacked"
+    nbits = padded_bits(len(cells))
+    return int.from_bytes(np.packbits(np.asarray(cells, dtype=np.uint8) & 1).tobytes(), 'big') if nbits else 0
+
+
+def unpacked(row, width):
+    "Returns a row integer as a uint8 array of its first width residues"
+    return np.unpackbits(packed(row, width))[:width]
+
+
+def fill_rect(grid, pad, taps, modulus, x0, y0, width, height, origin=(0, 0)):
+    """
+    Does what fractal._fill_rect does, for modulus 2, a row at a time: every row is redone from
+    its first cell to x0 + width, which gives the cells left of the rectangle back unchanged,
+    and the rectangle's part is written into grid
+    """
+    if modulus != 2:
+        raise ValueError("The bitset engine only handles modulus 2, not " + str(modulus))
+    right = x0 + width
+    above = [pack(grid[pad + y, pad:pad + right]) for y in range(y0 - pad, y0)]
+    rows = packed_rows(taps, right, height, above, origin is not None and origin == (0, y0))
+    for y, row in zip(range(y0, y0 + height), rows):
+        grid[pad + y, pad + x0:pad + right] = unpacked(row, right)[x0:]
+    # next row
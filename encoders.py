@@ -0,0 +1,326 @@
+import numpy as np
+import os
+import struct
+import zlib
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+IDAT_CHUNK_SIZE = 2 ** 16   # bytes of compressed data per IDAT chunk
+TIFF_ROWS_PER_STRIP = 256
+
+# TIFF field types: struct format and type number
+TIFF_SHORT = ('H', 3)
+TIFF_LONG = ('I', 4)
+TIFF_LONG8 = ('Q', 16)
+
+
+def png_chunk(chunk_type, data):
+    "Returns one PNG chunk: length, type, data and CRC"
+    return (struct.pack('>I', len(data))
+            + chunk_type
+            + data
+            + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def bit_depth_for(levels):
+    "Smallest of the bit depths 1, 2, 4 and 8 that has room for levels distinct pixel values"
+    for bit_depth in (1, 2, 4, 8):
+        if levels <= 2 ** bit_depth:
+            return bit_depth
+    raise ValueError("Can't store " + str(levels) + " levels in 8 bits")
+
+
+def gray_palette(levels):
+    "Palette of levels evenly spaced grays from black to white, as a list of (r, g, b)"
+    return [(gray, gray, gray) for gray in [level * 255 // max(levels - 1, 1) for level in range(levels)]]
+
+
+def colormap_palette(stops, levels):
+    """
+    Palette of levels colors spread evenly along a colormap, a list of (r, g, b) stops from the
+    color of level 0 to that of the top level, interpolating linearly between neighboring stops
+    """
+    stops = np.array(stops, dtype=np.float64).reshape(-1, 3)
+    if len(stops) == 1 or levels == 1:
+        return [tuple(int(value) for value in stops[0])] * levels
+    positions = np.linspace(0, len(stops) - 1, levels)
+    lower = np.minimum(positions.astype(int), len(stops) - 2)
+    fraction = (positions - lower)[:, None]
+    colors = stops[lower] * (1 - fraction) + stops[lower + 1] * fraction
+    return [tuple(int(value) for value in color) for color in np.rint(colors)]
+
+
+def pack_rows(rows, bit_depth):
+    """
+    Packs a 2D array of pixel values below 2 ^ bit_depth into bytes, several pixels per byte with
+    the first in the highest bits and each row padded to whole bytes, as PNG and TIFF store them.
+    """
+    rows = np.asarray(rows, dtype=np.uint8)
+    if bit_depth == 8:
+        return rows
+    if bit_depth == 1:
+        return np.packbits(rows, axis=1)
+    per_byte = 8 // bit_depth
+    width = rows.shape[1]
+    padded = np.zeros((rows.shape[0], -(-width // per_byte) * per_byte), dtype=np.uint8)
+    padded[:, :width] = rows
+    padded = padded.reshape(rows.shape[0], -1, per_byte)
+    packed = np.zeros(padded.shape[:2], dtype=np.uint8)
+    for k in range(per_byte):
+        packed |= padded[:, :, k] << (8 - bit_depth * (k + 1))
+    # next k
+    return packed
+
+
+def filtered_rows(rows, bit_depth):
+    "Returns rows as PNG stores them before compression: packed at bit_depth, each preceded by filter type 0 (none)"
+    return filtered_packed_rows(pack_rows(rows, bit_depth))
+
+
+def filtered_packed_rows(packed):
+    "Returns rows already packed by pack_rows as PNG stores them before compression, each preceded by filter type 0"
+    filtered = np.zeros((packed.shape[0], packed.shape[1] + 1), dtype=np.uint8)
+    filtered[:, 1:] = packed
+    return filtered.tobytes()
+
+
+def compress_frame(frame, bit_depth, compress_level=6):
+    """
+    Returns the compressed PNG image data of one whole frame, a 2D array of pixel values, for
+    APNGWriter.write_compressed_frame.  zlib lets go of the GIL while compressing, so frames can
+    be compressed on several threads at once.
+    """
+    return zlib.compress(filtered_rows(frame, bit_depth), compress_level)
+
+
+class ImageWriter:
+    """
+    Base of the streaming image writers: takes rows of pixel values a band at a time, so the whole
+    picture never has to be in memory.  Pixel values are gray levels at bit_depth bits (1 for
+    black and white), or indices into palette, a list of (r, g, b), if one is given.
+    Use as a context manager, or call close() after the last row.  As a context manager, the
+    file is deleted if an exception interrupts writing, so no truncated image is left behind.
+    """
+
+    def __init__(self, filename, width, height, compress_level=6, bit_depth=8, palette=None):
+        self.width = width
+        self.height = height
+        self.compress_level = compress_level
+        self.bit_depth = bit_depth
+        self.palette = palette
+        self.rows_written = 0
+        self.file = open(filename, 'wb')
+
+    def write_rows(self, rows):
+        "Appends a 2D array of rows, each width pixels long"
+        self.write_packed_rows(pack_rows(rows, self.bit_depth))
+
+    def write_packed_rows(self, packed):
+        "Appends rows already packed as pack_rows packs them, such as 1-bit rows straight from the bitset engine"
+        raise NotImplementedError
+
+    def finish(self):
+        "Writes whatever follows the last row"
+        raise NotImplementedError
+
+    def close(self):
+        "Finishes the image file. Raises ValueError if too few or too many rows were written"
+        try:
+            if self.rows_written != self.height:
+                raise ValueError("Image expects " + str(self.height) + " rows, got " + str(self.rows_written))
+            self.finish()
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't leave a truncated image behind
+            self.file.close()
+            os.remove(self.file.name)
+
+
+class PNGWriter(ImageWriter):
+    """
+    Writes a grayscale or, with a palette, indexed PNG.  Rows are compressed as they arrive and
+    written out in IDAT chunks.
+    """
+
+    def __init__(self, filename, width, height, compress_level=6, bit_depth=8, palette=None):
+        super().__init__(filename, width, height, compress_level, bit_depth, palette)
+        self.compressor = zlib.compressobj(compress_level)
+        self.pending = b''
+        colour_type = 0 if palette is None else 3
+        self.file.write(PNG_SIGNATURE)
+        self.file.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bit_depth, colour_type, 0, 0, 0)))
+        if palette is not None:
+            self.file.write(png_chunk(b'PLTE', bytes(value for colour in palette for value in colour)))
+
+    def write_packed_rows(self, packed):
+        self.pending += self.compressor.compress(filtered_packed_rows(packed))
+        self.rows_written += packed.shape[0]
+        self.flush_chunks()
+
+    def flush_chunks(self, final=False):
+        "Writes out compressed data in full IDAT chunks, or all of it if final"
+        while len(self.pending) >= IDAT_CHUNK_SIZE or (final and self.pending):
+            self.file.write(png_chunk(b'IDAT', self.pending[:IDAT_CHUNK_SIZE]))
+            self.pending = self.pending[IDAT_CHUNK_SIZE:]
+        # end while
+
+    def finish(self):
+        self.pending += self.compressor.flush()
+        self.flush_chunks(final=True)
+        self.file.write(png_chunk(b'IEND', b''))
+
+
+class TIFFWriter(ImageWriter):
+    """
+    Writes a striped BigTIFF, which has 64-bit offsets and so no 4 GB limit, for pictures too big
+    for most PNG readers.  Strips of rows_per_strip rows are deflate-compressed (or left
+    uncompressed if compress_level is 0) and written as they fill, and the directory describing
+    them goes at the end of the file.  Readers can then decode any strip on its own.
+    """
+
+    def __init__(self, filename, width, height, compress_level=6, bit_depth=8, palette=None,
+                 rows_per_strip=TIFF_ROWS_PER_STRIP):
+        super().__init__(filename, width, height, compress_level, bit_depth, palette)
+        self.rows_per_strip = rows_per_strip
+        self.pending = []
+        self.pending_rows = 0
+        self.strip_offsets = []
+        self.strip_byte_counts = []
+        # Header; the directory offset is filled in by finish
+        self.file.write(b'II' + struct.pack('<HHHQ', 43, 8, 0, 0))
+
+    def write_packed_rows(self, packed):
+        self.rows_written += packed.shape[0]
+        while packed.shape[0]:
+            take = self.rows_per_strip - self.pending_rows
+            self.pending.append(packed[:take].tobytes())
+            self.pending_rows += packed[:take].shape[0]
+            packed = packed[take:]
+            if self.pending_rows == self.rows_per_strip:
+                self.write_strip()
+        # end while
+
+    def write_strip(self):
+        "Writes the pending rows out as one strip"
+        data = b''.join(self.pending)
+        if self.compress_level:
+            data = zlib.compress(data, self.compress_level)
+        self.strip_offsets.append(self.file.tell())
+        self.strip_byte_counts.append(len(data))
+        self.file.write(data)
+        self.pending = []
+        self.pending_rows = 0
+
+    def finish(self):
+        if self.pending_rows:
+            self.write_strip()
+
+        entries = [
+            (256, TIFF_LONG, [self.width]),
+            (257, TIFF_LONG, [self.height]),
+            (258, TIFF_SHORT, [self.bit_depth]),
+            (259, TIFF_SHORT, [8 if self.compress_level else 1]),    # Adobe deflate, or none
+            (262, TIFF_SHORT, [1 if self.palette is None else 3]),    # black is zero, or palette
+            (273, TIFF_LONG8, self.strip_offsets),
+            (277, TIFF_SHORT, [1]),
+            (278, TIFF_LONG, [self.rows_per_strip]),
+            (279, TIFF_LONG8, self.strip_byte_counts),
+        ]
+        if self.palette is not None:
+            # 16-bit reds, then greens, then blues, for all 2 ^ bit_depth entries
+            colours = list(self.palette) + [(0, 0, 0)] * (2 ** self.bit_depth - len(self.palette))
+            entries.append((320, TIFF_SHORT, [colour[channel] * 257 for channel in range(3) for colour in colours]))
+
+        # Values too long for their entry are written before the directory, which points at them
+        fields = []
+        for tag, (value_format, field_type), values in entries:
+            data = struct.pack('<' + value_format * len(values), *values)
+            if len(data) > 8:
+                offset = self.file.tell()
+                self.file.write(data)
+                data = struct.pack('<Q', offset)
+            fields.append(struct.pack('<HHQ', tag, field_type, len(values)) + data.ljust(8, b'\0'))
+        # next entry
+
+        directory_offset = self.file.tell()
+        self.file.write(struct.pack('<Q', len(fields)) + b''.join(fields) + struct.pack('<Q', 0))
+        self.file.seek(8)
+        self.file.write(struct.pack('<Q', directory_offset))
+
+
+class APNGWriter:
+    """
+    Writes an animated PNG one frame at a time, so the frames never all have to be in memory.
+    Every frame is a whole width x height picture of pixel values, gray at bit_depth bits or
+    indices into palette, shown for delay_ms milliseconds; the animation repeats loops times
+    (0 for ever).  frame_count must be known up front, as it heads the file.
+    Use as a context manager, which deletes the file if an exception interrupts writing.
+    """
+
+    def __init__(self, filename, width, height, frame_count, delay_ms=100, loops=0, compress_level=6, bit_depth=8,
+                 palette=None):
+        self.width = width
+        self.height = height
+        self.frame_count = frame_count
+        self.delay_ms = delay_ms
+        self.compress_level = compress_level
+        self.bit_depth = bit_depth
+        self.frames_written = 0
+        self.sequence_number = 0    # shared by fcTL and fdAT chunks
+        self.file = open(filename, 'wb')
+        colour_type = 0 if palette is None else 3
+        self.file.write(PNG_SIGNATURE)
+        self.file.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, bit_depth, colour_type, 0, 0, 0)))
+        self.file.write(png_chunk(b'acTL', struct.pack('>II', frame_count, loops)))
+        if palette is not None:
+            self.file.write(png_chunk(b'PLTE', bytes(value for colour in palette for value in colour)))
+
+    def write_frame(self, frame):
+        "Appends a frame, a height x width array of pixel values"
+        self.write_compressed_frame(compress_frame(frame, self.bit_depth, self.compress_level))
+
+    def write_compressed_frame(self, data):
+        "Appends a frame already compressed by compress_frame"
+        if self.frames_written == self.frame_count:
+            raise ValueError("APNG expects " + str(self.frame_count) + " frames, got more")
+        # Frame control: size, offset 0, 0, delay in ms, no disposal, replace the previous frame
+        self.file.write(png_chunk(b'fcTL', struct.pack('>IIIIIHHBB', self.sequence_number, self.width, self.height,
+                                                       0, 0, self.delay_ms, 1000, 0, 0)))
+        self.sequence_number += 1
+        for start in range(0, len(data), IDAT_CHUNK_SIZE):
+            if self.frames_written == 0:
+                # The first frame doubles as the still image for readers without APNG support
+                self.file.write(png_chunk(b'IDAT', data[start:start + IDAT_CHUNK_SIZE]))
+            else:
+                self.file.write(png_chunk(b'fdAT', struct.pack('>I', self.sequence_number)
+                                          + data[start:start + IDAT_CHUNK_SIZE]))
+                self.sequence_number += 1
+        # next chunk
+        self.frames_written += 1
+
+    def close(self):
+        "Finishes the file. Raises ValueError if too few frames were written"
+        try:
+            if self.frames_written != self.frame_count:
+                raise ValueError("APNG expects " + str(self.frame_count) + " frames, got " + str(self.frames_written))
+            self.file.write(png_chunk(b'IEND', b''))
+        finally:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.file.name)
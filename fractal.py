@@ -1,18 +1,540 @@
 import numpy as np
 from PIL import Image
+import ast
+import collections
+import contextlib
 import copy
+import importlib.util
+import json
+import logging
 import os, sys, subprocess
+import threading
+import time
+import tracemalloc
+import bitset
+import encoders
+
+
+# Largest modulus whose products of residues stay exact in int64 arithmetic.  Sums of several such
+# products can still overflow, so past 2 ^ 63 / (taps * (modulus - 1) ^ 2) engines reduce each
+# product by the modulus as they add it (see overflows)
+MAX_VECTOR_MODULUS = 2 ** 31
+
+# Memory budget of each Fractal's residue cache
+DEFAULT_CACHE_BYTES = 256 * 2 ** 20
+
+# Rows per band when streaming, and the picture size above which saves stream by default
+DEFAULT_BAND_HEIGHT = 512
+STREAMING_SIZE = 4096
+
+# Anti-diagonals _fill_rect sweeps between calls to its checkpoint (see Fractal.checkpoint)
+CHECKPOINT_DIAGONALS = 256
+
+# Residue arrays at least this wide are computed across several processes when Fractal.workers > 1,
+# or is None on a machine with several cores
+PARALLEL_SIZE = 2048
+
+# Smallest prime whose self-similar expansion mirrors residue classes for symmetric coefficients:
+# for 2 and 3 the transposed, strided copies cost more than the few classes they save
+MIN_MIRRORED_LIFT_MODULUS = 5
+
+# Largest modulus whose residues are classified and colored through a lookup table; beyond it
+# tables would outgrow the arrays they index
+LOOKUP_TABLE_MODULUS = 2 ** 16
+
+# Output formats and their file extensions, and the picture size above which pictures are saved as
+# BigTIFF rather than PNG, which many readers can't open that large
+FORMAT_EXTENSIONS = {'png': '.png', 'tiff': '.tif', 'npy': '.npy', 'npz': '.npz'}
+TIFF_SIZE = 2 ** 15
+
+
+def output_format(picture, size):
+    "Picks an output format: raw residues as .npz, or .npy (built in place) if large; pictures as PNG, or BigTIFF if huge"
+    if picture == 'residues':
+        return 'npy' if size > STREAMING_SIZE else 'npz'
+    return 'tiff' if size > TIFF_SIZE else 'png'
+
+
+def format_from_filename(filename):
+    "Returns the output format filename's extension calls for, or None"
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.tiff':
+        return 'tiff'
+    for file_format, format_extension in FORMAT_EXTENSIONS.items():
+        if extension == format_extension:
+            return file_format
+    return None
+
+
+def residue_dtype(modulus):
+    "Returns the smallest unsigned numpy integer type that holds every residue of modulus."
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if modulus <= np.iinfo(dtype).max + 1:
+            return dtype
+    return np.int64
+
+
+def overflows(taps, modulus):
+    "Whether a sum of taps products of residues and weights below modulus can overflow int64"
+    return taps * (modulus - 1) ** 2 >= 2 ** 63
+
+
+def _fill_rect(grid, pad, taps, modulus, x0, y0, width, height, origin=(0, 0), symmetric=False, checkpoint=None):
+    """
+    Fills a width x height rectangle of residues whose top-left cell is (x0, y0), in place.
+    grid holds the residue array behind pad rows and columns of zeros, so grid[pad + y][pad + x]
+    is the residue at (x, y) and out-of-bounds references read zero.  Cells above and to the left
+    of the rectangle must already be final.  origin is the cell of grid holding the initial 1,
+    or None when grid holds a band of rows below the origin.
+    Each cell only depends on cells on earlier anti-diagonals, so the rectangle is swept one
+    anti-diagonal at a time.  In the flattened grid an anti-diagonal is a slice with stride
+    (row length - 1), and each tap is the same slice shifted back by a constant.
+    If symmetric, the taps and the cells already final are symmetric about the main diagonal and
+    the rectangle is a square on it (x0 == y0, width == height), so each anti-diagonal is its own
+    mirror image: only the half on and below the main diagonal is summed, and copied across.
+    The strided copy and the per-diagonal overhead remain, so in timings this ran 1.2 to 1.5
+    times as fast as the full sweep, not twice.
+    If given, checkpoint() is called every CHECKPOINT_DIAGONALS anti-diagonals, and may raise to stop.
+    """
+    row_length = grid.shape[1]
+    step = max(row_length - 1, 1)
+    flat = grid.reshape(-1)
+    corner = (pad + y0) * row_length + (pad + x0)
+    shifts = [(dy * row_length + dx, np.int64(weight)) for dx, dy, weight in taps]
+    reduce_each = overflows(len(taps), modulus)
+    accumulator = np.empty(min(width, height), dtype=np.int64)
+
+    for t in range(width + height - 1):
+        if checkpoint is not None and t % CHECKPOINT_DIAGONALS == 0:
+            checkpoint()
+        first_row = max(0, t - width + 1)
+        last_row = min(t, height - 1)
+        count = last_row - first_row + 1
+        start = corner + t + first_row * step
+        stop = start + (count - 1) * step + 1
+
+        if t == 0 and (x0, y0) == origin:
+            flat[start] = 1
+            continue
+
+        half = (t + 1) // 2 - first_row if symmetric else 0     # cells above the main diagonal
+        lower_start = start + half * step
+        diagonal = accumulator[:count - half]
+        diagonal[:] = 0
+        for shift, weight in shifts:
+            if weight == 1:
+                diagonal += flat[lower_start - shift:stop - shift:step]
+            else:
+                diagonal += flat[lower_start - shift:stop - shift:step] * weight
+            if reduce_each:
+                diagonal %= modulus
+        # next tap
+        diagonal %= modulus
+        flat[lower_start:stop:step] = diagonal
+        if half:
+            flat[start:lower_start:step] = diagonal[count - 2 * half:][::-1]
+    # next t
+
+
+def _fill_batch(grids, pad, offsets, weights, moduli):
+    """
+    Fills a stack of residue arrays at once, as _fill_rect fills one from the origin.  grids is
+    (batch, pad + size, pad + size), each behind pad rows and columns of zeros; offsets lists the
+    (dx, dy) of every tap used by any of them, weights is (batch, taps) with each array's weight
+    for each offset (zero where it doesn't use it), and moduli is (batch, 1).  Every array takes
+    the same anti-diagonal sweep, so numpy calls don't multiply with the batch.
+    """
+    row_length = grids.shape[2]
+    size = row_length - pad
+    step = max(row_length - 1, 1)
+    flat = grids.reshape(grids.shape[0], -1)
+    corner = pad * row_length + pad
+    shifts = [dy * row_length + dx for dx, dy in offsets]
+    reduce_each = overflows(len(offsets), int(moduli.max(initial=2)))
+    accumulator = np.empty((grids.shape[0], size), dtype=np.int64)
+
+    flat[:, corner] = 1
+    for t in range(1, 2 * size - 1):
+        first_row = max(0, t - size + 1)
+        last_row = min(t, size - 1)
+        count = last_row - first_row + 1
+        start = corner + t + first_row * step
+        stop = start + (count - 1) * step + 1
+
+        diagonal = accumulator[:, :count]
+        diagonal[:] = 0
+        for k, shift in enumerate(shifts):
+            diagonal += flat[:, start - shift:stop - shift:step] * weights[:, k:k + 1]
+            if reduce_each:
+                diagonal %= moduli
+        # next tap
+        diagonal %= moduli
+        flat[:, start:stop:step] = diagonal
+    # next t
+
+
+def _is_prime(n):
+    "Tests whether n is prime by trial division. Moduli are small, so this is plenty fast."
+    if n < 2:
+        return False
+    divisor = 2
+    while divisor * divisor <= n:
+        if n % divisor == 0:
+            return False
+        divisor += 1
+    return True
+
+
+def _frobenius_kernels(taps, p):
+    """
+    For prime p, returns the small kernels that expand a residue array by a factor of p.
+    If Q(X, Y) is the sum of weight * X^dx * Y^dy over the taps, the residues are the coefficients
+    of 1 / (1 - Q) modulo p.  Since (1 - Q)^p = 1 - Q(X^p, Y^p) modulo p, the residues equal
+    P(X, Y) times the residues with X and Y replaced by X^p and Y^p, where P = (1 - Q)^(p - 1).
+    So the residue at (p * x + u, p * y + v) only depends on the coefficients of P in the (u, v)
+    residue class and a few residues near (x, y).
+    Returns a dictionary from (u, v) to a list of (a, b, c) terms: add c times the residue at
+    (x - a, y - b).
+    """
+    pad = max([max(dx, dy) for dx, dy, weight in taps] + [0])
+    one_minus_q = np.zeros((pad + 1, pad + 1), dtype=np.int64)
+    one_minus_q[0][0] = 1
+    for dx, dy, weight in taps:
+        one_minus_q[dy][dx] = (one_minus_q[dy][dx] - weight) % p
+
+    # Raise 1 - Q to the power p - 1, multiplying 2D polynomials as coefficient arrays
+    power = np.ones((1, 1), dtype=np.int64)
+    for _ in range(p - 1):
+        product = np.zeros((power.shape[0] + pad, power.shape[1] + pad), dtype=np.int64)
+        for (j, i), c in np.ndenumerate(one_minus_q):
+            if c:
+                product[j:j + power.shape[0], i:i + power.shape[1]] += c * power
+        power = product % p
+
+    kernels = {}
+    for (j, i), c in np.ndenumerate(power):
+        if c:
+            kernels.setdefault((i % p, j % p), []).append((i // p, j // p, int(c)))
+    return kernels
+
+
+def _lift(coarse, margin, kernels, p, symmetric=False, checkpoint=None):
+    """
+    Expands a block of residues by a factor of p using kernels from _frobenius_kernels.
+    coarse holds the block behind margin extra rows and columns: the residues just above and
+    to the left of it, or zeros where those fall outside the array.  Returns the p times larger
+    block of residues.  If symmetric, coarse and the kernels are symmetric about the main
+    diagonal, and residue class (v, u) is taken as the transpose of class (u, v).
+    If given, checkpoint() is called before each residue class, and may raise to stop.
+    """
+    height = coarse.shape[0] - margin
+    width = coarse.shape[1] - margin
+    most_terms = max([len(terms) for terms in kernels.values()] + [0])
+    if (p - 1) ** 2 * most_terms < 2 ** 16:
+        accumulator_type = np.uint16
+    else:
+        accumulator_type = np.int64
+
+    fine = np.zeros((p * height, p * width), dtype=coarse.dtype)
+    for (u, v), terms in kernels.items():
+        if symmetric and u > v:
+            continue    # the transpose of class (v, u)
+        if checkpoint is not None:
+            checkpoint()
+        class_residues = np.zeros((height, width), dtype=accumulator_type)
+        for a, b, c in terms:
+            shifted = coarse[margin - b:margin - b + height, margin - a:margin - a + width]
+            if c == 1:
+                class_residues += shifted
+            else:
+                class_residues += shifted * accumulator_type(c)
+            if overflows(most_terms, p):
+                class_residues %= p
+        # next term
+        class_residues %= p
+        fine[v::p, u::p] = class_residues
+        if symmetric:
+            fine[u::p, v::p] = class_residues.T
+    # next residue class
+
+    return fine
+
+
+def _self_similar_residue_array(taps, p, size, dtype, known=None, symmetric=False, checkpoint=None):
+    """
+    Builds the size x size residue array for prime modulus p by repeated _lift, starting from
+    the 1 x 1 array holding the origin, or from known, a smaller residue array already computed.
+    Never runs the per-cell recurrence.  If symmetric, the taps are symmetric about the main
+    diagonal and each level only computes the residue classes on and below it.
+    checkpoint, if given, goes to each _lift.
+    """
+    kernels = _frobenius_kernels(taps, p)
+    margin = max([max(a, b) for terms in kernels.values() for a, b, c in terms] + [0])
+
+    # Sizes of each level, largest first: each level needs the first ceil(size / p) of the next
+    sizes = []
+    while size > 1 and (known is None or size > known.shape[0]):
+        sizes.append(size)
+        size = -(-size // p)
+    # end while
+
+    if known is None:
+        residues = np.ones((1, 1), dtype=dtype)
+    else:
+        residues = known[:size, :size]
+    for level_size in reversed(sizes):
+        coarse = np.zeros((margin + residues.shape[0], margin + residues.shape[1]), dtype=dtype)
+        coarse[margin:, margin:] = residues
+        residues = _lift(coarse, margin, kernels, p, symmetric, checkpoint)[:level_size, :level_size]
+    # next level
+
+    return residues
+
+
+def _self_similar_window_pays(pad, p, cells):
+    """
+    Whether _self_similar_window is cheaper than streaming the cells rows and columns reach from
+    the origin to a window's far corner.  Its kernels (see _frobenius_kernels) take about
+    p ^ 3 * pad ^ 2 operations and an array of ((p - 1) * pad) ^ 2 coefficients, so large primes
+    only pay for windows far from the origin, and never once that array outgrows the cache budget.
+    """
+    kernel_cells = ((p - 1) * pad + 1) ** 2
+    return p * kernel_cells <= cells and kernel_cells * 8 <= DEFAULT_CACHE_BYTES
+
+
+def _self_similar_window(taps, p, x0, y0, width, height, dtype):
+    """
+    Returns the width x height block of residues whose top-left cell is (x0, y0), for prime
+    modulus p, without computing anything outside it but a few coarser blocks.  The block is
+    _lift of a block about p times smaller around (x0 / p, y0 / p), itself found the same way,
+    down to the origin: one level per base-p digit of the offset, so the cost depends on the
+    window size and the logarithm of the offset.  Cells at negative coordinates read zero.
+    """
+    kernels = _frobenius_kernels(taps, p)
+    margin = max([max(a, b) for terms in kernels.values() for a, b, c in terms] + [0])
+
+    def window(x0, y0, width, height):
+        block = np.zeros((height, width), dtype=dtype)
+        left, top = max(x0, 0), max(y0, 0)
+        right, bottom = x0 + width, y0 + height
+        if right <= left or bottom <= top:
+            return block
+        if right == 1 and bottom == 1:
+            block[-y0, -x0] = 1     # only the origin is inside the array
+            return block
+
+        # Coarse cells the block depends on, plus margin cells above and to the left
+        coarse_x0, coarse_y0 = left // p - margin, top // p - margin
+        coarse_x1, coarse_y1 = (right - 1) // p + 1, (bottom - 1) // p + 1
+        coarse = window(coarse_x0, coarse_y0, coarse_x1 - coarse_x0, coarse_y1 - coarse_y0)
+        fine = _lift(coarse, margin, kernels, p)
+        fine_x0, fine_y0 = p * (left // p), p * (top // p)
+        block[top - y0:, left - x0:] = fine[top - fine_y0:bottom - fine_y0, left - fine_x0:right - fine_x0]
+        return block
+
+    return window(x0, y0, width, height)
+
+
+STATS_LOGGER = logging.getLogger('cosmatesque.stats')
+
+
+def log_stage(event):
+    "Observer that logs each stage event as a line of JSON on the 'cosmatesque.stats' logger"
+    STATS_LOGGER.info(json.dumps(event))
+
+
+class StageTimer:
+    """
+    Context manager that times one stage of a render and passes observer a dictionary with the
+    stage name, the given fields, wall_seconds, cpu_seconds (of this thread) and peak_bytes.
+    peak_bytes is the most memory allocated at once during the stage beyond what was allocated
+    when it started, and is only measured while tracemalloc is tracing (otherwise None).
+    Stages may nest; an outer stage's peak includes its inner stages'.
+    """
+    nesting = threading.local()
+
+    def __init__(self, observer, name, **fields):
+        self.observer = observer
+        self.event = dict(stage=name, **fields)
+
+    def __enter__(self):
+        self.outer = getattr(StageTimer.nesting, 'stage', None)
+        StageTimer.nesting.stage = self
+        self.tracing = tracemalloc.is_tracing()
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.outer is not None:
+                self.outer.peak = max(self.outer.peak, peak)
+            self.start_bytes = current
+            self.peak = current
+            tracemalloc.reset_peak()
+        self.cpu_start = time.thread_time()
+        self.wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.event['wall_seconds'] = time.perf_counter() - self.wall_start
+        self.event['cpu_seconds'] = time.thread_time() - self.cpu_start
+        self.event['peak_bytes'] = None
+        if self.tracing and tracemalloc.is_tracing():
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            self.event['peak_bytes'] = self.peak - self.start_bytes
+            if self.outer is not None:
+                self.outer.peak = max(self.outer.peak, self.peak)
+        if exc_type is not None:
+            self.event['error'] = exc_type.__name__
+        StageTimer.nesting.stage = self.outer
+        self.observer(self.event)
+
+
+class RenderCancelled(Exception):
+    "Raised from a progress callback to abandon a render"
+
+
+class CompactResidues:
+    """
+    Residue array stored compactly: one byte per residue, or bit-packed for small moduli with
+    1 bit per residue (modulus 2) or 2 bits per residue (modulus up to 4).  Packed rows start on
+    a byte boundary, most significant bits first, which is the layout PIL and PNG use.
+    """
+
+    def __init__(self, data, shape, modulus, bits):
+        self.data = data            # uint8 numpy array, one row of bytes per row of residues
+        self.shape = shape          # (height, width) in residues
+        self.modulus = modulus
+        self.bits = bits            # bits per residue: 1, 2 or 8
+
+    @classmethod
+    def from_array(cls, residues, modulus, bits=None):
+        "Packs a numpy residue array.  By default bit-packs modulus 2 and stores others as bytes"
+        if bits is None:
+            bits = 1 if modulus == 2 else 8
+        if modulus > 2 ** bits:
+            raise ValueError(str(bits) + " bits cannot hold residues modulo " + str(modulus))
+
+        height, width = residues.shape
+        if bits == 8:
+            data = np.ascontiguousarray(residues, dtype=np.uint8)
+        elif bits == 1:
+            data = np.packbits(residues.astype(np.uint8), axis=1)
+        elif bits == 2:
+            # Four residues per byte: pad each row to a multiple of 4, then shift into place
+            quads = np.zeros((height, -(-width // 4) * 4), dtype=np.uint8)
+            quads[:, :width] = residues
+            quads = quads.reshape(height, -1, 4)
+            data = (quads[:, :, 0] << 6) | (quads[:, :, 1] << 4) | (quads[:, :, 2] << 2) | quads[:, :, 3]
+        else:
+            raise ValueError("bits must be 1, 2 or 8")
+        return cls(data, (height, width), modulus, bits)
+
+    def nbytes(self):
+        "Memory held by the packed residues"
+        return self.data.nbytes
+
+    def to_array(self):
+        "Unpacks to a uint8 numpy array of residues"
+        height, width = self.shape
+        if self.bits == 8:
+            return self.data
+        if self.bits == 1:
+            return np.unpackbits(self.data, axis=1, count=width)
+        quads = np.stack([(self.data >> shift) & 3 for shift in (6, 4, 2, 0)], axis=-1)
+        return quads.reshape(height, -1)[:, :width]
+
+
+class ResidueCache:
+    """
+    Least-recently-used store of residue arrays, keyed by Fractal.residue_key and bounded by
+    a total memory budget in bytes.  Arrays are stored read-only so slices handed out stay valid.
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.arrays = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def nbytes(self):
+        "Total memory held by cached arrays"
+        with self.lock:
+            return sum(array.nbytes for array in self.arrays.values())
+
+    def get(self, key):
+        "Returns the cached array for key, or None, and marks it most recently used"
+        with self.lock:
+            if key not in self.arrays:
+                return None
+            self.arrays.move_to_end(key)
+            return self.arrays[key]
+
+    def put(self, key, array):
+        """
+        Caches array under key, replacing any smaller one, then evicts least recently used arrays.
+        An array at least as large already cached is kept instead, so a small render finishing
+        late can't push out a large one.
+        """
+        with self.lock:
+            existing = self.arrays.get(key)
+            if existing is not None and existing.shape[0] >= array.shape[0]:
+                self.arrays.move_to_end(key)
+                return
+            self.arrays.pop(key, None)
+            if array.nbytes > self.max_bytes:
+                return
+            array.flags.writeable = False
+            self.arrays[key] = array
+            while sum(array.nbytes for array in self.arrays.values()) > self.max_bytes:
+                self.arrays.popitem(last=False)
+            # end while
+
+    def clear(self):
+        with self.lock:
+            self.arrays.clear()
 
 
 class Fractal:
     "Describes/generates a fractal using an array of recurrence coefficients and a modulus."
 
-    def __init__(self, coefficients=[[0, 1], [1, 0]], modulus=2, white_residues=[1]):
+    def __init__(self, coefficients=[[0, 1], [1, 0]], modulus=2, white_residues=[1], cache=None, store=None,
+                 observer=None, workers=1, palette=None, colormap=None, backend=None):
         # Default parameters generate the Sierpinski triangle
         self.coefficients = coefficients.copy()
         self.reach = len(coefficients)
         self.modulus = modulus
         self.white_residues = white_residues
+        # Pass one ResidueCache to several Fractals to share it
+        self.residue_cache = ResidueCache() if cache is None else cache
+        # Optional store.ResidueStore keeping residue arrays on disk between sessions
+        self.store = store
+        # Memory-mapped residue file from open_residue_file, and the residue_key it belongs to
+        self.residue_file = None
+        self.residue_file_key = None
+        # Optional callback receiving a StageTimer event dictionary per render stage, e.g. log_stage
+        self.observer = observer
+        # Processes sharing one large render (see parallel.py); None for one per core
+        self.workers = workers
+        # Optional (r, g, b) per residue for color pictures; None for white residues white, the rest black
+        self.palette = palette
+        # Optional (r, g, b) stops spread over the gradient's layer counts; None for black to white
+        self.colormap = colormap
+        # Name of the backend in BACKENDS computing residues; None to pick per size (see backend_name)
+        self.backend = backend
+        # Optional function the backends call between chunks of a residue computation; it may raise
+        # RenderCancelled to stop it.  Set for the length of a save with progress (see checkpoints)
+        self.checkpoint = None
+
+    def copy(self):
+        "Returns a Fractal with copies of the current parameters that shares this one's residue cache and store"
+        return Fractal(coefficients=copy.deepcopy(self.coefficients),
+                       modulus=self.modulus,
+                       white_residues=list(self.white_residues),
+                       cache=self.residue_cache,
+                       store=self.store,
+                       observer=self.observer,
+                       workers=self.workers,
+                       palette=None if self.palette is None else list(self.palette),
+                       colormap=None if self.colormap is None else list(self.colormap),
+                       backend=self.backend)
 
     def summary(self):
         "Summarizes the fractal-generating arguments as a string. Good for filenames"
@@ -30,8 +552,168 @@ class Fractal:
         )
         return summary_string
 
+    @classmethod
+    def from_summary(cls, summary, **keywords):
+        """
+        Makes a Fractal from a string in the format of summary, such as a filename or URL part;
+        keywords go to the constructor.  Raises ValueError if summary is malformed.
+        """
+        try:
+            coefficients_text, rest = summary.split(', modulus=')
+            modulus_text, white_residues_text = rest.split(', white_residues=')
+            coefficients = ast.literal_eval(coefficients_text)
+            modulus = int(modulus_text)
+            white_residues = ast.literal_eval(white_residues_text)
+            # Coefficients must be square-minus-a-corner
+            reach = len(coefficients)
+            well_formed = (modulus >= 2 and reach > 0
+                           and all(len(row) == reach for row in coefficients[:-1]) and len(coefficients[-1]) == reach - 1
+                           and all(isinstance(entry, int) for row in coefficients for entry in row)
+                           and all(isinstance(residue, int) for residue in white_residues))
+        except (ValueError, SyntaxError, TypeError):
+            well_formed = False
+        if not well_formed:
+            raise ValueError("Not a fractal summary: " + summary)
+        coefficients = [list(row) for row in coefficients]
+        coefficients[-1].append(0)
+        return cls(coefficients=coefficients, modulus=modulus, white_residues=white_residues, **keywords)
+
+    def stage(self, name, size, **fields):
+        "Returns a StageTimer reporting to the observer, or a do-nothing context if there is none"
+        if self.observer is None:
+            return contextlib.nullcontext()
+        return StageTimer(self.observer, name, parameters=self.summary(), size=size, **fields)
+
+    @contextlib.contextmanager
+    def checkpoints(self, checkpoint):
+        "Context manager setting the checkpoint attribute to checkpoint, and back again on exit"
+        previous, self.checkpoint = self.checkpoint, checkpoint
+        try:
+            yield
+        finally:
+            self.checkpoint = previous
+
+    def taps(self):
+        """
+        Lists the recurrence as (dx, dy, weight) tuples: each residue adds weight times the residue
+        dx columns to the left and dy rows above.  Weights are reduced by the modulus and the
+        cursor entry, which never contributes, is left out.
+        """
+        offset = self.reach - 1
+        return [(offset - x_i, offset - y_i, self.coefficients[y_i][x_i] % self.modulus)
+                for y_i in range(self.reach) for x_i in range(self.reach)
+                if (x_i, y_i) != (offset, offset)]
+
+    def stencil(self):
+        """
+        Compiles the coefficients into what the engines loop over: the nonzero taps, as listed in
+        residue_key, and pad, the furthest any of them reaches back.  Engines therefore cost time
+        in proportion to the number of nonzero coefficients rather than reach squared, and zero
+        padding (which takes the place of bounds checks) is only as wide as the taps reach.
+        """
+        taps = self.residue_key()[0]
+        pad = max([max(dx, dy) for dx, dy, weight in taps] + [0])
+        return taps, pad
+
+    def residue_key(self):
+        """
+        Identifies the residue array canonically: the modulus and the sorted nonzero taps, so
+        coefficients are reduced by the modulus, the cursor entry is ignored, and arrays padded
+        with zeros to a larger reach match.  White residues don't affect residues, so they are left out.
+        Read afresh on every call, so changing coefficients or modulus in place (as the GUI does)
+        switches to a new cache entry.
+        """
+        return (tuple(sorted(tap for tap in self.taps() if tap[2])), self.modulus)
+
+    def shared_key(self):
+        """
+        Returns (key, transposed): the key the residue array is cached and stored under, and
+        whether this fractal's array is the transpose of the one kept there.  Swapping dx and dy
+        in every tap transposes the residue array, so a parameter set and its transpose share the
+        lesser of their two residue_keys.
+        """
+        key = self.residue_key()
+        taps, modulus = key
+        mirror = (tuple(sorted((dy, dx, weight) for dx, dy, weight in taps)), modulus)
+        return (key, False) if key <= mirror else (mirror, True)
+
+    def symmetric(self):
+        "Whether the coefficients, and so the residue array, are symmetric about the main diagonal"
+        taps = self.residue_key()[0]
+        return taps == tuple(sorted((dy, dx, weight) for dx, dy, weight in taps))
+
     def residue_array(self, size):
-        "Carries out recurrence relation to calculate, return residues in size x size array as list-of-lists."
+        """
+        Returns residues in size x size read-only numpy array.  Served from the residue cache,
+        or failing that the on-disk store, when a large enough array is there; otherwise the
+        largest array found is extended from its edge.
+        Transposed parameter sets share entries, each array kept in the orientation of shared_key.
+        """
+        key, transposed = self.shared_key()
+        with self.stage('residue lookup', size):
+            known = self.known_residue_array(size)
+        if known is not None and known.shape[0] >= size:
+            return known[:size, :size]
+
+        with self.stage('recurrence', size, extended_from=None if known is None else known.shape[0],
+                        backend=self.backend_name(size)):
+            residues = self.compute_residue_array(size, known)
+        residues.flags.writeable = False
+        shared = residues.T if transposed else residues
+        self.residue_cache.put(key, shared)
+        if self.store is not None:
+            self.store.put(key, shared)
+        return residues
+
+    def known_residue_array(self, size):
+        """
+        Returns the largest residue array already computed, from the residue cache or, if that has
+        none of at least size, the on-disk store, then the memory-mapped residue file.
+        Returns None if none has one.  Never computes.
+        """
+        key, transposed = self.shared_key()
+        known = self.residue_cache.get(key)
+        if (known is None or known.shape[0] < size) and self.store is not None:
+            stored = self.store.get(key)
+            if stored is not None and (known is None or stored.shape[0] > known.shape[0]):
+                known = stored
+                self.residue_cache.put(key, known)
+                known.flags.writeable = False
+        if known is not None and transposed:
+            known = known.T
+        if (known is None or known.shape[0] < size) and self.residue_file_key == self.residue_key():
+            if known is None or self.residue_file.shape[0] > known.shape[0]:
+                known = self.residue_file
+        return known
+
+    def backend_name(self, size):
+        """
+        Names the backend in BACKENDS that computes the size x size residue array: self.backend if
+        set (raising ValueError if it can't), otherwise the COSMATESQUE_BACKEND environment variable
+        where that backend can, otherwise choose_backend.
+        """
+        if self.backend is not None:
+            if self.backend not in BACKENDS or not BACKENDS[self.backend].supports(self, size):
+                raise ValueError("Backend " + repr(self.backend) + " can't compute " + self.summary())
+            return self.backend
+        name = os.environ.get('COSMATESQUE_BACKEND')
+        if name in BACKENDS and BACKENDS[name].supports(self, size):
+            return name
+        return choose_backend(self, size)
+
+    def compute_residue_array(self, size, known=None):
+        """
+        Carries out recurrence relation to calculate, return residues in size x size numpy array,
+        with the backend named by backend_name.
+        If given, known is the smaller top-left corner of the array, which is kept rather than redone.
+        """
+        return BACKENDS[self.backend_name(size)].compute(self, size, known)
+
+    def reference_residue_array(self, size):
+        """
+        Carries out recurrence relation one cell at a time, returns residues as list-of-lists.
+        Slow; kept as the reference that residue_array must match exactly.
+        """
 
         # Initialize residue array
         residues = [[0 for x in range(size)] for y in range(size)]
@@ -59,93 +741,639 @@ class Fractal:
 
         return residues
 
-    def bw_image(self, size):
-        "Generates black and white PIL Image object"
+    def residue_bands(self, size, band_height=DEFAULT_BAND_HEIGHT, width=None):
+        """
+        Yields the rows of the size x size residue array in bands of band_height rows (the last
+        may be shorter), holding only one band plus the pad rows above it in memory (see stencil).
+        If width is given, rows are cut to their first width columns, which are all they depend on.
+        Each band is a view that is overwritten when the next band is requested.
+        If a large enough residue array was already computed, bands are sliced from it instead.
+        """
+        width = size if width is None else width
+        known = self.known_residue_array(max(size, width))
+        if known is not None and known.shape[0] >= max(size, width):
+            for y0 in range(0, size, band_height):
+                yield known[y0:y0 + band_height, :width]
+            return
 
-        residues = self.residue_array(size)
+        taps, pad = self.stencil()
+        backend_name = self.backend_name(width)
+        if backend_name == 'parallel':
+            import parallel     # imported here as parallel.py itself imports this module
+            yield from parallel.residue_bands(taps, pad, self.modulus, size, width, residue_dtype(self.modulus),
+                                              band_height, self.workers)
+            return
 
-        # Black = 0, white = 255.  Initialize all black.
-        monochrome_array = np.zeros((size, size), dtype=np.uint8)
-        for x in range(size):
-            for y in range(size):
-                if residues[y][x] in self.white_residues:
-                    monochrome_array[y][x] = 255
-        img = Image.fromarray(monochrome_array, mode='L')
+        fill = BACKENDS[backend_name].fill
+        if fill is None:
+            # Backends that only make whole arrays stream with a row engine: bit-parallel for modulus 2
+            fill = bitset.fill_rect if self.modulus == 2 else _fill_rect
+        buffer = np.zeros((pad + band_height, pad + width), dtype=residue_dtype(self.modulus))
+        for y0 in range(0, size, band_height):
+            height = min(band_height, size - y0)
+            fill(buffer, pad, taps, self.modulus, 0, 0, width, height,
+                 origin=(0, 0) if y0 == 0 else None)
+            yield buffer[pad:pad + height, pad:]
+            # Keep the last pad rows of the band as the rows above the next one
+            buffer[:pad] = buffer[height:height + pad].copy()
+        # next band
 
-        return img
+    def residue_window(self, x0, y0, width, height, band_height=DEFAULT_BAND_HEIGHT):
+        """
+        Returns the residues in the width x height window whose top-left cell is (x0, y0), as a new
+        numpy array, without computing the whole square from the origin where it can be avoided:
+        sliced from an array already computed if one covers the window, expanded by self-similarity
+        for prime moduli where that is cheaper (cost grows with the logarithm of the offset, but
+        as the cube of the modulus), and otherwise streamed down
+        to the window in bands, keeping only x0 + width columns of one band in memory.
+        Cells at negative coordinates, outside the array, are zero.
+        """
+        window = np.zeros((height, width), dtype=residue_dtype(self.modulus))
+        left, top = max(x0, 0), max(y0, 0)
+        right, bottom = x0 + width, y0 + height
+        if right <= left or bottom <= top:
+            return window
 
-    def gradient_image(self, size):
-        "Generates gradient PIL Image object"
+        with self.stage('window', max(width, height), x0=x0, y0=y0):
+            known = self.known_residue_array(max(right, bottom))
+            if known is not None and known.shape[0] >= max(right, bottom):
+                window[top - y0:, left - x0:] = known[top:bottom, left:right]
+            elif self.modulus > MAX_VECTOR_MODULUS:
+                window[top - y0:, left - x0:] = self.compute_residue_array(max(right, bottom))[top:bottom, left:right]
+            elif _is_prime(self.modulus) and _self_similar_window_pays(self.stencil()[1], self.modulus, right * bottom):
+                window[:] = _self_similar_window(self.stencil()[0], self.modulus, x0, y0, width, height,
+                                                 window.dtype)
+            else:
+                band_y0 = 0
+                for band in self.residue_bands(bottom, band_height, width=right):
+                    rows = band[max(top - band_y0, 0):bottom - band_y0, left:]
+                    if rows.shape[0]:
+                        window[band_y0 + max(top - band_y0, 0) - y0:][:rows.shape[0], left - x0:] = rows
+                    band_y0 += band.shape[0]
+                # next band
+        return window
 
-        residues = self.residue_array(size)
+    def window_image(self, x0, y0, width, height):
+        "Generates black and white PIL Image object of the window from residue_window, for panning and zooming"
+        bw = self.classify(self.residue_window(x0, y0, width, height))
+        return Image.frombytes('1', (width, height), np.packbits(bw, axis=1).tobytes())
 
-        # Convert residue array to 0 = black and 1 = white.
-        bw_base = [[0 for x in range(size)] for y in range(size)]
-        for x in range(size):
+    def residue_memmap(self, filename, size, band_height=DEFAULT_BAND_HEIGHT):
+        """
+        Computes the size x size residue array straight into a .npy file through numpy.memmap, a band
+        at a time, so only the band being worked on is held in memory and arrays larger than memory
+        can be built.  Records residue_key alongside, in filename + '.json'.
+        Returns the result of open_residue_file on the new file.
+        """
+        residues = np.lib.format.open_memmap(filename, mode='w+', dtype=residue_dtype(self.modulus),
+                                             shape=(size, size))
+        y0 = 0
+        for band in self.residue_bands(size, band_height):
+            residues[y0:y0 + band.shape[0]] = band
+            y0 += band.shape[0]
+        # next band
+        residues.flush()
+        del residues
+
+        with open(filename + '.json', 'w') as key_file:
+            json.dump({'residue_key': repr(self.residue_key())}, key_file)
+        return self.open_residue_file(filename)
+
+    def open_residue_file(self, filename):
+        """
+        Memory-maps a residue file written by residue_memmap, read-only, and returns it.  From then
+        on it is a source of residues for these parameters: residue_array, bw_image, gradient_image
+        and the streaming bands read from it lazily instead of computing.  Slices of the returned
+        array, such as crops [y0:y1, x0:x1] and downsampled views [::k, ::k], read straight from
+        the file without copying.  Raises ValueError if the file holds residues for other parameters.
+        """
+        with open(filename + '.json') as key_file:
+            file_key = json.load(key_file)['residue_key']
+        if file_key != repr(self.residue_key()):
+            raise ValueError(filename + " holds residues for other parameters: " + file_key)
+
+        self.residue_file = np.load(filename, mmap_mode='r')
+        self.residue_file_key = self.residue_key()
+        return self.residue_file
+
+    def bw_rows(self, size, band_height=DEFAULT_BAND_HEIGHT):
+        "Yields rows of the size x size array of 0 = black and 1 = white, streamed in bands"
+        for band in self.residue_bands(size, band_height):
+            yield from self.classify(band)
+
+    def packed_bw_rows(self, size, band_height=DEFAULT_BAND_HEIGHT):
+        """
+        Yields bands of rows of the bw picture packed 8 pixels to a byte, first pixel in the highest
+        bit, as 1-bit PNG and TIFF store them.  For modulus 2, unless the residues are already known,
+        rows come packed straight from the bitset engine and are never spread out a byte per cell.
+        """
+        known = self.known_residue_array(size)
+        if self.modulus != 2 or (known is not None and known.shape[0] >= size):
+            for band in self.level_rows('bw', size, band_height):
+                yield np.packbits(band, axis=1)
+            return
+
+        # Pixels are white_table of residues: all ones if 0 is white, flipped where residues are 1 if 1 isn't
+        black_white = self.white_table()
+        nbits = bitset.padded_bits(size)
+        flip = (1 << nbits) - 1 if black_white[0] else 0
+        keep = black_white[0] != black_white[1]
+        band = []
+        for row in bitset.packed_rows(self.stencil()[0], size, size):
+            band.append(bitset.packed((row if keep else 0) ^ flip, size))
+            if len(band) == band_height:
+                yield np.array(band)
+                band = []
+        # next row
+        if band:
+            yield np.array(band)
+
+    def layered_rows(self, size, layers, band_height=DEFAULT_BAND_HEIGHT):
+        """
+        Yields rows of the black/white array summed over its first layers zoomed-in layers, as
+        gradient_image stacks them.  Row y of layer d is row y // modulus ^ d of the black/white
+        array, so the zoomed layers come from a smaller stream of the same kind, advanced one row
+        every modulus rows.  Memory is a band per layer rather than the whole array.
+        """
+        if layers == 0:
             for y in range(size):
-                if residues[y][x] in self.white_residues:
-                    bw_base[y][x] = 1
-                # end if
-            # next y
-        # next x
+                yield np.zeros(size, dtype=np.uint8)
+            return
+
+        bw_rows = self.bw_rows(size, band_height)
+        if layers == 1:
+            yield from bw_rows
+            return
+
+        coarse_rows = self.layered_rows(-(-size // self.modulus), layers - 1, band_height)
+        for y, row in enumerate(bw_rows):
+            if y % self.modulus == 0:
+                zoomed_row = next(coarse_rows).repeat(self.modulus)[:size]
+            yield row + zoomed_row
+        # next y
+
+    def white_table(self):
+        "Lookup table from residue to 1 = white or 0 = black, one entry per residue"
+        table = np.zeros(self.modulus, dtype=np.uint8)
+        table[[residue for residue in self.white_residues if 0 <= residue < self.modulus]] = 1
+        return table
+
+    def classify(self, residues):
+        """
+        Returns residues as 0 = black and 1 = white, in one pass of indexing white_table by the
+        residues rather than a membership test per residue
+        """
+        if self.modulus > LOOKUP_TABLE_MODULUS:
+            return np.isin(residues, self.white_residues).astype(np.uint8)
+        return self.white_table()[residues]
+
+    def residue_colors(self):
+        "Lists the (r, g, b) color of each residue: palette if set, otherwise white residues white and the rest black"
+        if self.palette is not None:
+            return [tuple(color) for color in self.palette[:self.modulus]]
+        return [(255, 255, 255) if white else (0, 0, 0) for white in self.white_table()]
+
+    def gradient_colors(self, levels):
+        "Lists the (r, g, b) color of each gradient layer count from 0 to levels - 1, from colormap or grays"
+        if self.colormap is None:
+            return encoders.gray_palette(levels)
+        return encoders.colormap_palette(self.colormap, levels)
 
-        # Iteration parameter: smallest integer d for which modulus ^ d >= residue array size
-        # Equivalent to math.ceil(math.log(size, self.modulus)) without rounding errors
+    def depth(self, size):
+        """
+        Number of zoomed-in layers the gradient picture stacks: the smallest integer d for which
+        modulus ^ d >= size.  Equivalent to math.ceil(math.log(size, self.modulus)) without rounding errors.
+        Gradient pixels are layer counts from 0 to depth.
+        """
         depth = 0
         while self.modulus ** depth < size:
             depth += 1
+        return depth
 
-        # Stack zoomed-in layers of bw_base atop one another
-        layered_bw = [[0 for x in range(size)] for y in range(size)]
-        for x in range(size):
-            for y in range(size):
-                new_value = 0
-                for d in range(depth):  # Ignore largest value, which would overlay entire image when exact power
-                    new_value += bw_base[y // self.modulus ** d][x // self.modulus ** d]
-                # next d
-                layered_bw[y][x] = new_value
-            # next y
-        # next x
+    def level_rows(self, picture, size, band_height=DEFAULT_BAND_HEIGHT):
+        """
+        Yields bands of rows of pixel levels without building the whole picture: 0 = black and
+        1 = white for bw, residues (indices into residue_colors) for color, layer counts from 0 to
+        depth(size) for gradient
+        """
+        if picture == 'bw':
+            for band in self.residue_bands(size, band_height):
+                yield self.classify(band)
+            return
+        if picture == 'color':
+            for band in self.residue_bands(size, band_height):
+                yield band.astype(np.uint8)
+            return
 
-        # Black = 0, white = 255.  Initialize all black.
-        gradient_array = np.zeros((size, size), dtype=np.uint8)
-        for x in range(size):
-            for y in range(size):
-                gradient_array[y][x] = int(layered_bw[y][x] * 255 / (depth))
-        img = Image.fromarray(gradient_array, mode='L')
+        band = []
+        for row in self.layered_rows(size, self.depth(size), band_height):
+            band.append(row)
+            if len(band) == band_height:
+                yield np.array(band, dtype=np.uint8)
+                band = []
+        # next row
+        if band:
+            yield np.array(band, dtype=np.uint8)
+
+    def pixel_format(self, picture, size):
+        """
+        Returns (bit_depth, palette) for encoders to store the levels of picture in: 1-bit gray
+        for bw, residue_colors for color, and for gradient its depth(size) + 1 gradient_colors,
+        palettes at the fewest bits that hold them
+        """
+        if picture == 'bw':
+            return 1, None
+        if picture == 'color':
+            return encoders.bit_depth_for(self.modulus), self.residue_colors()
+        levels = self.depth(size) + 1
+        return encoders.bit_depth_for(levels), self.gradient_colors(levels)
+
+    def save_image(self, filename, picture='bw', size=1024, stream=None, progress=None, file_format=None,
+                   compress_level=6):
+        """
+        Saves the bw, color or gradient picture, or with picture 'residues' the raw residue array.
+        file_format is one of FORMAT_EXTENSIONS; by default it follows the filename extension, or
+        failing that output_format.  Pictures are written by encoders.PNGWriter or TIFFWriter at
+        the pixel_format bit depth, with zlib compress_level from 0 (none) to 9.
+        Streams a band at a time if stream is True, or if stream is None and size exceeds STREAMING_SIZE.
+        If given, progress(rows_done, rows_total) is called as rows are finished; it may raise
+        RenderCancelled to stop, in which case no file is left behind.  Whole arrays are computed
+        before any row is done, so meanwhile the backends call progress(0, size) as a checkpoint.
+        """
+        if stream is None:
+            stream = size > STREAMING_SIZE
+        if file_format is None:
+            file_format = format_from_filename(filename) or output_format(picture, size)
+
+        checkpoint = (lambda: progress(0, size)) if progress else None
+        with self.stage('save', size, picture=picture, filename=filename, stream=stream, file_format=file_format):
+            if progress:
+                progress(0, size)
+            if file_format in ('npy', 'npz'):
+                try:
+                    with self.checkpoints(checkpoint):
+                        self.save_residues(filename, size, file_format, stream)
+                    if progress:
+                        progress(size, size)
+                except RenderCancelled:
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                    raise
+                return
+
+            bit_depth, palette = self.pixel_format(picture, size)
+            writer_class = encoders.TIFFWriter if file_format == 'tiff' else encoders.PNGWriter
+            if not stream:
+                with self.checkpoints(checkpoint):
+                    if picture == 'bw':
+                        levels = self.bw_levels(size)
+                    elif picture == 'color':
+                        levels = self.residue_array(size)
+                    else:
+                        levels = self.gradient_levels(size)
+                # Encoded a band at a time, so progress can report, and cancel, before the file is closed
+                with self.stage('encoding', size, picture=picture, file_format=file_format):
+                    with writer_class(filename, size, size, compress_level, bit_depth, palette) as writer:
+                        for y0 in range(0, size, DEFAULT_BAND_HEIGHT):
+                            writer.write_rows(levels[y0:y0 + DEFAULT_BAND_HEIGHT])
+                            if progress:
+                                progress(writer.rows_written, size)
+                        # next band
+                return
+
+            # Rows are computed and encoded together, so streaming is one stage
+            with writer_class(filename, size, size, compress_level, bit_depth, palette) as writer:
+                if picture == 'bw':
+                    bands, write = self.packed_bw_rows(size), writer.write_packed_rows
+                else:
+                    bands, write = self.level_rows(picture, size), writer.write_rows
+                for band in bands:
+                    write(band)
+                    if progress:
+                        progress(writer.rows_written, size)
+                # next band
+
+    def save_residues(self, filename, size, file_format='npy', stream=False):
+        """
+        Saves the size x size residue array: as .npy, built in the file a band at a time by
+        residue_memmap if stream is True, or as compressed .npz along with the modulus and residue_key
+        """
+        if file_format == 'npz':
+            np.savez_compressed(filename, residues=self.residue_array(size), modulus=self.modulus,
+                                residue_key=np.array(repr(self.residue_key())))
+        elif stream:
+            self.residue_memmap(filename, size)
+        else:
+            np.save(filename, self.residue_array(size))
+
+    def bw_levels(self, size):
+        "Returns the size x size array of 0 = black and 1 = white"
+        residues = self.residue_array(size)
+        with self.stage('classification', size):
+            return self.classify(residues)
+
+    def bw_image(self, size):
+        "Generates black and white PIL Image object, in 1-bit mode '1'"
+
+        bw = self.bw_levels(size)
+        with self.stage('image conversion', size):
+            img = Image.frombytes('1', (size, size), np.packbits(bw, axis=1).tobytes())
 
         return img
 
+    def color_image(self, size):
+        "Generates PIL Image object coloring each residue by residue_colors, as a palette image"
+        residues = self.residue_array(size)
+        with self.stage('image conversion', size):
+            img = palette_image(residues, self.residue_colors())
+        return img
+
+    def gradient_levels(self, size, bw_base=None):
+        """
+        Returns the size x size array of gradient layer counts, from 0 = black to depth(size) = white.
+        bw_base, if given, is a black and white array as bw_levels returns, at least size square, to
+        layer instead of bw_levels(size).
+        """
+
+        # Convert residue array to 0 = black and 1 = white.
+        if bw_base is None:
+            bw_base = self.bw_levels(size)
+        depth = self.depth(size)
+
+        # Stack zoomed-in layers of bw_base atop one another.  Layer d is bw_base zoomed in by
+        # modulus ^ d, so only its top-left ceil(size / modulus ^ d) square shows.  Work from the
+        # coarsest layer down: zoom the running total in by the modulus, then add the next layer.
+        # Ignore layer d = depth, which would overlay entire image when exact power.
+        with self.stage('layering', size, depth=depth):
+            layered_bw = np.zeros((1, 1), dtype=np.uint8)
+            for d in reversed(range(depth)):
+                layer_size = -(-size // self.modulus ** d)
+                layered_bw = layered_bw.repeat(self.modulus, axis=0).repeat(self.modulus, axis=1)
+                layered_bw = layered_bw[:layer_size, :layer_size] + bw_base[:layer_size, :layer_size]
+            # next d
+
+        return layered_bw[:size, :size]
+
+    def gradient_image(self, size):
+        "Generates gradient PIL Image object"
+
+        layered_bw = self.gradient_levels(size)
+        if self.colormap is not None:
+            with self.stage('image conversion', size):
+                img = palette_image(layered_bw, self.gradient_colors(self.depth(size) + 1))
+            return img
+
+        # Black = 0, white = 255.
+        gradient_array = (layered_bw.astype(np.uint16) * 255 // max(self.depth(size), 1)).astype(np.uint8)
+        with self.stage('image conversion', size):
+            img = Image.fromarray(gradient_array, mode='L')
+
+        return img
+
+
+# Compute backends, by name.  compute(fractal, size, known) returns the size x size residue array
+# as Fractal.compute_residue_array does; fill, if not None, fills a rectangle of a padded grid as
+# _fill_rect does, for streaming in bands; supports(fractal, size) tells whether the backend can
+# compute that array.  Add backends with register_backend.
+Backend = collections.namedtuple('Backend', ['compute', 'fill', 'supports'])
+BACKENDS = {}
+
+
+def register_backend(name, compute, fill=None, supports=None):
+    "Adds a backend to BACKENDS, by default supporting every fractal"
+    BACKENDS[name] = Backend(compute, fill, supports or (lambda fractal, size: True))
+
+
+def _grid_backend(fill, mirrors=False):
+    """
+    Returns a compute function running fill over a zero-padded grid, extending known if given.
+    If mirrors, fill takes symmetric and checkpoint as _fill_rect does, and for symmetric fractals
+    the cells above the main diagonal are copied rather than summed; the whole grid is still
+    allocated.  Otherwise, when the fractal has a checkpoint, fill runs a band of rows at a time
+    with the checkpoint called before each band.
+    """
+    def compute(fractal, size, known=None):
+        taps, pad = fractal.stencil()
+        grid = np.zeros((pad + size, pad + size), dtype=residue_dtype(fractal.modulus))
+        symmetric = mirrors and fractal.symmetric()
+        checkpoint = fractal.checkpoint
+
+        def fill_rows(x0, y0, width, height, **options):
+            if mirrors or checkpoint is None:
+                if mirrors:
+                    options['checkpoint'] = checkpoint
+                fill(grid, pad, taps, fractal.modulus, x0, y0, width, height, **options)
+                return
+            for band_y0 in range(y0, y0 + height, DEFAULT_BAND_HEIGHT):
+                checkpoint()
+                fill(grid, pad, taps, fractal.modulus, x0, band_y0, width,
+                     min(DEFAULT_BAND_HEIGHT, y0 + height - band_y0), **options)
+            # next band
+
+        n = 0
+        if known is not None:
+            n = known.shape[0]
+            grid[pad:pad + n, pad:pad + n] = known
+        if symmetric:
+            # Below the known corner, its mirror image right of it, then the square beyond both
+            if n:
+                fill_rows(0, n, n, size - n)
+                grid[pad:pad + n, pad + n:] = grid[pad + n:, pad:pad + n].T
+            fill_rows(n, n, size - n, size - n, symmetric=True)
+        elif known is None:
+            fill_rows(0, 0, size, size)
+        else:
+            # Extend right of the known corner, then below it across the full width
+            fill_rows(n, 0, size - n, n)
+            fill_rows(0, n, size, size - n)
+        return grid[pad:, pad:]
+    return compute
+
+
+def _python_backend(fractal, size, known=None):
+    "The reference: one cell at a time in pure Python, exact for any modulus"
+    dtype = object if fractal.modulus > MAX_VECTOR_MODULUS else residue_dtype(fractal.modulus)
+    return np.array(fractal.reference_residue_array(size), dtype=dtype).reshape(size, size)
+
+
+def _prime_backend(fractal, size, known=None):
+    "Prime moduli are self-similar: expand level by level instead of cell by cell"
+    return _self_similar_residue_array(fractal.stencil()[0], fractal.modulus, size, residue_dtype(fractal.modulus),
+                                       known, fractal.symmetric() and fractal.modulus >= MIN_MIRRORED_LIFT_MODULUS,
+                                       fractal.checkpoint)
+
+
+def _parallel_backend(fractal, size, known=None):
+    "Wavefront tiles across fractal.workers processes"
+    import parallel     # imported here as parallel.py itself imports this module
+    taps, pad = fractal.stencil()
+    return parallel.residue_array(taps, pad, fractal.modulus, size, residue_dtype(fractal.modulus), known,
+                                  fractal.workers, fractal.checkpoint)
+
+
+def _jit_fill_rect(grid, pad, taps, modulus, x0, y0, width, height, origin=(0, 0)):
+    "_fill_rect through the Numba-compiled per-cell kernel in jit.py"
+    import jit      # imported here as importing Numba takes a while
+    jit.fill_rect(grid, pad, taps, modulus, x0, y0, width, height, origin)
+
+
+def jit_available():
+    "Whether Numba is installed, so the 'numba' backend can run"
+    return importlib.util.find_spec('numba') is not None
+
+
+def _vectorizable(fractal, size):
+    return fractal.modulus <= MAX_VECTOR_MODULUS
+
+
+def _self_similar(fractal, size):
+    # A prime past size would lift straight to a modulus x modulus block, for no gain over the sweep
+    return _vectorizable(fractal, size) and _is_prime(fractal.modulus) and fractal.modulus <= max(size, 2)
+
+
+register_backend('python', _python_backend)
+register_backend('numpy', _grid_backend(_fill_rect, mirrors=True), _fill_rect, _vectorizable)
+register_backend('prime', _prime_backend, None, lambda fractal, size: _self_similar(fractal, size))
+register_backend('parallel', _parallel_backend, None, _vectorizable)
+register_backend('bitset', _grid_backend(bitset.fill_rect), bitset.fill_rect,
+                 lambda fractal, size: fractal.modulus == 2)
+register_backend('numba', _grid_backend(_jit_fill_rect), _jit_fill_rect,
+                 lambda fractal, size: _vectorizable(fractal, size) and jit_available())
+
+
+def choose_backend(fractal, size):
+    """
+    Picks a backend by modulus and size: pure Python for moduli too large for 64-bit arithmetic,
+    self-similar expansion for primes up to size, wavefront tiles for large arrays when the fractal has
+    several workers, and the vectorized diagonal sweep otherwise.  The compiled 'numba' kernel is
+    only run when named: timed against the sweep it was no faster (0.54 s to 0.48 s for a
+    modulus 4 array of 4096 x 4096) and its first call pays for compiling (1.3 s at 300 x 300).
+    """
+    if not _vectorizable(fractal, size):
+        return 'python'
+    if _self_similar(fractal, size):
+        return 'prime'
+    if (fractal.workers or os.cpu_count() or 1) > 1 and size >= PARALLEL_SIZE:
+        return 'parallel'
+    return 'numpy'
+
+
+def batch_residue_arrays(fractals, size):
+    """
+    Computes the size x size residue arrays of many parameter sets in one pass, for galleries of
+    thumbnails: the distinct arrays are stacked along a batch axis and share one vectorized sweep,
+    each with its own weights and modulus, so a batch takes about as many numpy calls as a single
+    array.  Each array is put in its fractal's residue cache, so drawing it afterwards (bw_image
+    and the like, at size or less) doesn't compute it again.  Returns the arrays in the order of
+    fractals.  Raises ValueError for a modulus over MAX_VECTOR_MODULUS.
+    """
+    keys = [fractal.residue_key() for fractal in fractals]
+    for taps, modulus in keys:
+        if modulus > MAX_VECTOR_MODULUS:
+            raise ValueError("Modulus " + str(modulus) + " is too large to batch")
+    distinct_keys = list(dict.fromkeys(keys))
+
+    offsets = sorted(set((dx, dy) for taps, modulus in distinct_keys for dx, dy, weight in taps))
+    column = {offset: k for k, offset in enumerate(offsets)}
+    weights = np.zeros((len(distinct_keys), len(offsets)), dtype=np.int64)
+    for i, (taps, modulus) in enumerate(distinct_keys):
+        for dx, dy, weight in taps:
+            weights[i, column[(dx, dy)]] = weight
+        # next tap
+    # next key
+    moduli = np.array([[modulus] for taps, modulus in distinct_keys], dtype=np.int64)
+    pad = max([max(offset) for offset in offsets] + [0])
+
+    dtype = residue_dtype(max([modulus for taps, modulus in distinct_keys] + [2]))
+    grids = np.zeros((len(distinct_keys), pad + size, pad + size), dtype=dtype)
+    if distinct_keys:
+        _fill_batch(grids, pad, offsets, weights, moduli)
+    stacked = dict((key, grids[i, pad:, pad:].astype(residue_dtype(key[1])))
+                   for i, key in enumerate(distinct_keys))
+
+    for fractal, key in zip(fractals, keys):
+        stacked[key].flags.writeable = False
+        shared_key, transposed = fractal.shared_key()
+        known = fractal.residue_cache.get(shared_key)
+        if known is None or known.shape[0] < size:
+            fractal.residue_cache.put(shared_key, stacked[key].T if transposed else stacked[key])
+    # next fractal
+    return [stacked[key] for key in keys]
+
+
+def palette_image(levels, colors):
+    """
+    Colors a 2D array of levels by looking each up in colors, a list of (r, g, b), with no loop
+    over pixels: a palette image for up to 256 colors, otherwise an RGB image made in one
+    fancy-indexing pass
+    """
+    height, width = levels.shape
+    if len(colors) <= 256:
+        img = Image.frombytes('P', (width, height), np.ascontiguousarray(levels, dtype=np.uint8).tobytes())
+        img.putpalette([value for color in colors for value in color])
+        return img
+    rgb = np.array(colors, dtype=np.uint8)[levels]
+    return Image.frombytes('RGB', (width, height), rgb.tobytes())
+
 
 def make_image(coefficients=[[0, 1], [1]],
                modulus=2,
                white_residues=[1],
                picture='bw',size=1024,
-               open_file=False):
+               open_file=False,
+               stream=None,
+               directory='',
+               store=True,
+               stats=False,
+               workers=1,
+               file_format=None,
+               compress_level=6,
+               palette=None,
+               colormap=None):
     "Generates and saves an image using Cosmatesque filenames as arguments"
     # Useful for people who want to explore beyond the limitations of the GUI:
     # for example, iterating over a range of parameters or using larger coefficient arrays.
     # Default arguments generate Sierpinski triangle optimized for screen (white on black).
     # Coefficients must be square-minus-a-corner.  Currently no error checking of arguments.
+    # Large pictures are streamed to disk in bands; set stream to True or False to force either way.
+    # Saves into directory (default: working directory) and returns the path of the saved file.
+    # Residue arrays are kept in the per-user on-disk store unless store is False (or another store.ResidueStore).
+    # For rendering many parameter sets at once, see batch.py.
+    # With stats=True, each stage's time and memory is logged as JSON (see log_stage); stats may also be an observer.
+    # workers > 1 (or None, for one per core) spreads one large render across processor cores (see parallel.py).
+    # picture may also be 'color' (residues colored by palette, one (r, g, b) per residue) or 'residues' for the
+    # raw residue array; colormap lists (r, g, b) stops to color gradients by.  file_format is a key of FORMAT_EXTENSIONS,
+    # by default picked by output_format; compress_level is zlib's, from 0 (fastest) to 9 (smallest).
 
     # Add final '0' to coefficient array
     coefficients[-1].append(0)
 
+    if store is True:
+        import store as residue_store   # imported here as store.py itself imports this module
+        store = residue_store.ResidueStore()
+    elif store is False:
+        store = None
+
     # Make fractal object
-    fr = Fractal(coefficients=coefficients, modulus=modulus, white_residues=white_residues)
+    if stats is True:
+        if not STATS_LOGGER.hasHandlers():
+            logging.basicConfig(level=logging.INFO, format='%(message)s')
+        STATS_LOGGER.setLevel(logging.INFO)
+        stats = log_stage
+    fr = Fractal(coefficients=coefficients, modulus=modulus, white_residues=white_residues, store=store,
+                 observer=stats or None, workers=workers, palette=palette, colormap=colormap)
 
-    filename = (fr.summary()
-                + ", picture= '" + picture
-                + "', size=" + str(size)
-                + ".png"
-                )
+    file_format = file_format or output_format(picture, size)
+    filename = os.path.join(directory,
+                            fr.summary()
+                            + ", picture= '" + picture
+                            + "', size=" + str(size)
+                            + FORMAT_EXTENSIONS[file_format]
+                            )
 
     # Save image
-    if picture == 'bw':
-        img = fr.bw_image(size=size)
-    else:
-        img = fr.gradient_image(size=size)
-    img.save(filename)
+    fr.save_image(filename, picture=picture, size=size, stream=stream, file_format=file_format,
+                  compress_level=compress_level)
     
     if open_file:
         if sys.platform == 'win32':
@@ -153,3 +1381,5 @@ def make_image(coefficients=[[0, 1], [1]],
         else:
             opener = "open" if sys.platform == "darwin" else "xdg-open"
             subprocess.call([opener, filename])
+
+    return filename
@@ -0,0 +1,58 @@
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Per-cell recurrence kernel for the 'numba' backend of fractal.py.  Written as plain loops over
+# cells and taps, which Numba compiles to machine code, so it runs at close to native speed while
+# staying in Python.  Without Numba installed the backend is simply unavailable; the kernel still
+# runs (very slowly) as ordinary Python, which is handy for checking it.
+
+
+def fill_rect_kernel(grid, pad, dxs, dys, weights, modulus, x0, y0, width, height, origin_x, origin_y,
+                     reduce_each):
+    """
+    Fills the width x height rectangle of grid whose top-left cell is (x0, y0) row by row, as
+    fractal._fill_rect does.  Row order is safe because every tap points up, left, or both.
+    If reduce_each, the sum is reduced by the modulus after every product, so sums of large
+    residues can't overflow 64 bits; otherwise only once per cell, keeping the tap loop branch-free.
+    """
+    for y in range(y0, y0 + height):
+        for x in range(x0, x0 + width):
+            if x == origin_x and y == origin_y:
+                grid[pad + y, pad + x] = 1
+                continue
+            total = 0
+            if reduce_each:
+                for k in range(len(weights)):
+                    total = (total + weights[k] * np.int64(grid[pad + y - dys[k], pad + x - dxs[k]])) % modulus
+                # next tap
+            else:
+                for k in range(len(weights)):
+                    total += weights[k] * np.int64(grid[pad + y - dys[k], pad + x - dxs[k]])
+                # next tap
+            grid[pad + y, pad + x] = total % modulus
+        # next x
+    # next y
+
+
+if numba is not None:
+    compiled_kernel = numba.njit(cache=True, nogil=True)(fill_rect_kernel)
+else:
+    compiled_kernel = None
+
+
+def fill_rect(grid, pad, taps, modulus, x0, y0, width, height, origin=(0, 0), kernel=None):
+    """
+    Same as fractal._fill_rect, with the compiled kernel (or another, such as the uncompiled
+    fill_rect_kernel for checking)
+    """
+    kernel = kernel or compiled_kernel
+    dxs = np.array([dx for dx, dy, weight in taps], dtype=np.int64)
+    dys = np.array([dy for dx, dy, weight in taps], dtype=np.int64)
+    weights = np.array([weight for dx, dy, weight in taps], dtype=np.int64)
+    origin_x, origin_y = (-1, -1) if origin is None else origin
+    reduce_each = len(taps) * (modulus - 1) ** 2 >= 2 ** 63
+    kernel(grid, pad, dxs, dys, weights, np.int64(modulus), x0, y0, width, height, origin_x, origin_y, reduce_each)
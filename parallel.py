@@ -0,0 +1,163 @@
+import concurrent.futures
+import os
+from multiprocessing import shared_memory
+import numpy as np
+import fractal as fr
+
+# Computes one large residue array on several processor cores.  Each residue only depends on
+# residues at most pad cells up and to the left, so once the grid is cut into tiles at least pad
+# wide, a tile only waits for the tiles directly above it and to its left.  Tiles are handed to a
+# pool of worker processes in wavefront order, each as soon as those two are done, and every
+# process reads and writes the one grid in shared memory: nothing is copied between them.
+# Fractal uses this when its workers attribute is above 1, e.g.
+#
+#   fractal.make_image([[0, 1, 1], [1, 1, 0], [1, 1]], modulus=4, size=16384, workers=32)
+
+
+MIN_TILE_SIZE = 512     # smaller tiles spend more time in numpy call overhead than they save
+MAX_TILE_SIZE = 2048
+TILES_PER_WORKER = 2    # tiles along each side per worker, so the wavefront keeps every worker busy
+MAX_BAND_BYTES = 64 * 2 ** 20   # shared grid residue_bands may grow a band to, for the tile rows it wants
+
+_executors = {}         # worker count -> process pool, kept for later renders
+_attached = {}          # in a worker: shared memory name -> (SharedMemory, grid), for the current grid only
+
+
+class SharedGrid:
+    """
+    Zero-filled numpy array in shared memory, as a context manager: the array is attribute
+    array, and the shared memory is released on exit.  Worker processes attach to it by name.
+    """
+
+    def __init__(self, shape, dtype):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.memory = shared_memory.SharedMemory(create=True,
+                                                 size=max(int(np.prod(self.shape)) * self.dtype.itemsize, 1))
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.memory.buf)
+        self.array[:] = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        del self.array      # views of the buffer have to go before it can be closed
+        self.memory.close()
+        self.memory.unlink()
+        return False
+
+
+def executor(workers):
+    "Returns a pool of workers processes, created on first use and then reused"
+    if workers not in _executors:
+        _executors[workers] = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    return _executors[workers]
+
+
+def tile_size(width, height, pad, workers):
+    "Side of the square tiles a width x height rectangle is cut into for workers processes"
+    side = -(-max(width, height) // (TILES_PER_WORKER * workers))
+    return max(min(max(side, MIN_TILE_SIZE), MAX_TILE_SIZE), pad, 1)
+
+
+def _fill_tile(name, shape, dtype, pad, taps, modulus, x0, y0, width, height, origin):
+    "Runs in a worker process: attaches to the shared grid and fills one tile with fractal._fill_rect"
+    if name not in _attached:
+        while _attached:
+            memory = _attached.popitem()[1][0]
+            memory.close()
+        # end while
+        memory = shared_memory.SharedMemory(name=name)
+        _attached[name] = (memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf))
+    fr._fill_rect(_attached[name][1], pad, taps, modulus, x0, y0, width, height, origin)
+
+
+def fill_rect(shared, pad, taps, modulus, x0, y0, width, height, origin=(0, 0), workers=None, known=0,
+              checkpoint=None):
+    """
+    Does what fractal._fill_rect does to shared.array, a SharedGrid, across workers processes
+    (default: one per core).  Tiles inside the known x known square at the top left of the
+    rectangle are taken as final already and skipped.  If given, checkpoint() is called as tiles
+    finish; if it raises, tiles not yet started are cancelled and the exception passes on.
+    """
+    workers = workers or os.cpu_count() or 1
+    side = tile_size(width, height, pad, workers)
+    columns = -(-width // side)
+    rows = -(-height // side)
+    pool = executor(workers)
+
+    finished = set((i, j) for j in range(rows) for i in range(columns)
+                   if (i + 1) * side <= known and (j + 1) * side <= known)
+    pending = {}
+
+    def submit_if_ready(i, j):
+        if i >= columns or j >= rows or (i, j) in finished or (i, j) in pending.values():
+            return
+        if (i == 0 or (i - 1, j) in finished) and (j == 0 or (i, j - 1) in finished):
+            tile_x0 = x0 + i * side
+            tile_y0 = y0 + j * side
+            future = pool.submit(_fill_tile, shared.memory.name, shared.shape, shared.dtype.str, pad, taps,
+                                 modulus, tile_x0, tile_y0, min(side, x0 + width - tile_x0),
+                                 min(side, y0 + height - tile_y0), origin)
+            pending[future] = (i, j)
+
+    for j in range(rows):
+        for i in range(columns):
+            submit_if_ready(i, j)
+        # next i
+    # next j
+
+    while pending:
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        if checkpoint is not None:
+            try:
+                checkpoint()
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                # next pending tile
+                raise
+        for future in done:
+            i, j = pending.pop(future)
+            future.result()     # re-raises any error from the worker
+            finished.add((i, j))
+            submit_if_ready(i + 1, j)
+            submit_if_ready(i, j + 1)
+        # next finished tile
+    # end while
+
+
+def residue_array(taps, pad, modulus, size, dtype, known=None, workers=None, checkpoint=None):
+    """
+    Returns the size x size residue array, as Fractal.compute_residue_array does for composite
+    moduli, computed across workers processes.  known, a smaller residue array already computed,
+    is copied in and only the rest is computed.  checkpoint, if given, goes to fill_rect.
+    """
+    with SharedGrid((pad + size, pad + size), dtype) as shared:
+        n = 0
+        if known is not None:
+            n = known.shape[0]
+            shared.array[pad:pad + n, pad:pad + n] = known
+        fill_rect(shared, pad, taps, modulus, 0, 0, size, size, workers=workers, known=n, checkpoint=checkpoint)
+        return shared.array[pad:, pad:].copy()
+
+
+def residue_bands(taps, pad, modulus, size, width, dtype, band_height, workers=None):
+    """
+    Yields bands of rows of the residue array as Fractal.residue_bands does, each computed across
+    workers processes.  Bands are grown towards one row of tiles per worker, since tiles in the
+    same row of tiles have to be computed one after another, but only as far as the shared grid
+    fits in MAX_BAND_BYTES.  Each band is a copy, as views would keep the shared memory from
+    being released.
+    """
+    workers = workers or os.cpu_count() or 1
+    budget_rows = MAX_BAND_BYTES // ((pad + width) * np.dtype(dtype).itemsize) - pad
+    band_height = max(band_height, min(workers * tile_size(width, band_height, pad, workers), budget_rows))
+    with SharedGrid((pad + band_height, pad + width), dtype) as shared:
+        for y0 in range(0, size, band_height):
+            height = min(band_height, size - y0)
+            fill_rect(shared, pad, taps, modulus, 0, 0, width, height,
+                      origin=(0, 0) if y0 == 0 else None, workers=workers)
+            yield shared.array[pad:pad + height, pad:].copy()
+            shared.array[:pad] = shared.array[height:height + pad].copy()
+        # next band
@@ -0,0 +1,195 @@
+import hashlib
+import os, sys
+import tempfile
+import time
+import numpy as np
+import fractal as fr
+
+
+# Disk budget of the residue store, and how old a leftover temporary file must be to be cleaned up
+DEFAULT_STORE_BYTES = 2 * 2 ** 30
+STALE_TEMP_SECONDS = 60 * 60
+DEFAULT_PREVIEW_ENTRIES = 512
+
+
+def default_directory():
+    "Per-user cache directory for stored residue arrays.  The COSMATESQUE_STORE environment variable overrides it"
+    if os.environ.get('COSMATESQUE_STORE'):
+        return os.environ['COSMATESQUE_STORE']
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base, 'cosmatesque', 'residues')
+
+
+class ResidueStore:
+    """
+    Persistent, content-addressed store of residue arrays, keyed by Fractal.residue_key.
+    Each key maps to one .npz file named by a hash of the key, holding the largest array computed
+    for it, bit-packed as CompactResidues (1 bit per residue for modulus 2, 2 bits up to modulus 4)
+    along with the key itself.  The files are self-describing, so the directory listing serves as
+    the index: no shared index file has to be locked.
+    Several processes may use one directory at once.  Files are written under a temporary name
+    and moved into place atomically, so readers never see a partial file.  Reads mark a file
+    recently used by touching it, and when the directory outgrows max_bytes the least recently
+    used files are deleted.
+    """
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_STORE_BYTES):
+        self.directory = default_directory() if directory is None else directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        "File holding the residue array for key"
+        return os.path.join(self.directory, hashlib.sha256(repr(key).encode()).hexdigest()[:32] + '.npz')
+
+    def stored_size(self, key):
+        "Size of the stored array for key, or 0 if there is none"
+        try:
+            with np.load(self.path(key)) as entry:
+                if str(entry['key']) != repr(key):
+                    return 0
+                return int(entry['shape'][0])
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def get(self, key):
+        "Returns the stored residue array for key as a numpy array, or None"
+        path = self.path(key)
+        try:
+            with np.load(path) as entry:
+                if str(entry['key']) != repr(key):
+                    return None     # hash collision
+                compact = fr.CompactResidues(entry['data'], tuple(entry['shape']), int(entry['modulus']),
+                                             int(entry['bits']))
+        except (OSError, ValueError, KeyError):
+            return None     # missing, or deleted by another process mid-read
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return np.array(compact.to_array(), dtype=fr.residue_dtype(compact.modulus))
+
+    def put(self, key, residues):
+        "Stores residues under key unless an array at least as large is stored already"
+        if residues.shape[0] <= self.stored_size(key):
+            return
+
+        modulus = key[1]
+        bits = 1 if modulus <= 2 else 2 if modulus <= 4 else 8
+        if modulus > 256:
+            return      # stored as bytes, so only moduli whose residues fit in one
+        compact = fr.CompactResidues.from_array(residues, modulus, bits)
+        if compact.nbytes() > self.max_bytes:
+            return
+
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as temporary_file:
+                np.savez(temporary_file, data=compact.data, shape=np.array(compact.shape), modulus=modulus,
+                         bits=bits, key=np.array(repr(key)))
+            os.replace(temporary_path, self.path(key))
+        except OSError:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            return
+        self.evict()
+
+    def evict(self):
+        "Deletes least recently used files until the store fits in max_bytes, and stale temporary files"
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            if entry.name.endswith('.npz'):
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+            elif entry.name.endswith('.tmp') and time.time() - stat.st_mtime > STALE_TEMP_SECONDS:
+                self.remove(entry.path)
+        # next entry
+
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self.remove(path)
+            total -= size
+        # next entry
+
+    def remove(self, path):
+        "Deletes a file, tolerating another process having deleted it or holding it open"
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        "Deletes every stored array"
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                self.remove(entry.path)
+
+
+class PreviewCache:
+    """
+    On-disk cache of rendered preview images as PNG data, keyed by anything with a stable repr
+    (the GUI uses the parameters, picture and sizes), so previews seen before, the startup preview
+    above all, show without rendering.  Lives in a 'previews' directory inside the residue store's
+    directory by default, written the same way: atomically, keeping the max_entries most
+    recently used.
+    """
+
+    def __init__(self, directory=None, max_entries=DEFAULT_PREVIEW_ENTRIES):
+        self.directory = os.path.join(default_directory(), 'previews') if directory is None else directory
+        self.max_entries = max_entries
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        "File holding the preview for key"
+        return os.path.join(self.directory, hashlib.sha256(repr(key).encode()).hexdigest()[:32] + '.png')
+
+    def get(self, key):
+        "Returns the cached PNG data for key, or None"
+        try:
+            with open(self.path(key), 'rb') as preview_file:
+                png_data = preview_file.read()
+            os.utime(self.path(key))
+        except OSError:
+            return None
+        return png_data
+
+    def put(self, key, png_data):
+        "Caches PNG data under key"
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as temporary_file:
+                temporary_file.write(png_data)
+            os.replace(temporary_path, self.path(key))
+        except OSError:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            return
+        self.evict()
+
+    def evict(self):
+        "Deletes least recently used previews beyond max_entries"
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.name.endswith('.png'):
+                    entries.append((entry.stat().st_mtime, entry.path))
+            except OSError:
+                continue
+        # next entry
+        for mtime, path in sorted(entries)[:max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        # next entry
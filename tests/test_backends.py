@@ -0,0 +1,88 @@
+import random
+import numpy as np
+import pytest
+import fractal as fr
+import jit
+
+# Conformance of every compute backend with reference_residue_array, the pure-Python recurrence
+
+
+SIZE = 48
+
+
+def random_cases():
+    "Reproducible (coefficients, modulus) pairs over reaches 1 to 5, each also made symmetric"
+    generator = random.Random(0)
+    cases = []
+    for reach in range(1, 6):
+        for modulus in [2, 3, 4, 6, 7, 9, 10, 256, 65537]:
+            coefficients = [[generator.randrange(modulus) for x in range(reach)] for y in range(reach)]
+            coefficients[-1][-1] = 0
+            symmetric = [[coefficients[max(x, y)][min(x, y)] for x in range(reach)] for y in range(reach)]
+            cases += [(coefficients, modulus), (symmetric, modulus)]
+        # next modulus
+    # next reach
+    sparse = [[0] * 7 for y in range(7)]
+    sparse[0][3], sparse[6][0], sparse[3][6], sparse[5][5] = 1, 1, 1, 2
+    return cases + [(sparse, 4)]
+
+
+def limit_cases():
+    "Moduli on either side of MAX_VECTOR_MODULUS, with enough large taps to overflow a plain int64 sum"
+    generator = random.Random(1)
+    cases = []
+    for reach in [2, 3, 5]:
+        coefficients = [[generator.randrange(2 ** 31 - 1) for x in range(reach)] for y in range(reach)]
+        coefficients[-1][-1] = 0
+        cases += [(coefficients, 2 ** 31 - 1), (coefficients, fr.MAX_VECTOR_MODULUS)]
+    # next reach
+    return cases + [([[1, 1], [1, 0]], fr.MAX_VECTOR_MODULUS + 1), ([[3, 1], [1, 0]], 2 ** 40)]
+
+
+def reference(coefficients, modulus, size=SIZE):
+    return np.array(fr.Fractal(coefficients=coefficients, modulus=modulus).reference_residue_array(size))
+
+
+@pytest.mark.parametrize('name', sorted(fr.BACKENDS))
+@pytest.mark.parametrize('coefficients, modulus', random_cases() + limit_cases())
+def test_backend_matches_reference(name, coefficients, modulus):
+    fractal = fr.Fractal(coefficients=coefficients, modulus=modulus, workers=2)
+    backend = fr.BACKENDS[name]
+    if not backend.supports(fractal, SIZE):
+        pytest.skip(name + " doesn't support this case")
+    expected = reference(coefficients, modulus)
+    assert (backend.compute(fractal, SIZE) == expected).all()
+    # Extended from a known corner, as residue_array does from the cache
+    known = np.array(expected[:SIZE // 3, :SIZE // 3])
+    assert (backend.compute(fractal, SIZE, known) == expected).all()
+
+
+@pytest.mark.parametrize('coefficients, modulus', limit_cases())
+def test_automatic_backend_past_modulus_limits(coefficients, modulus):
+    fractal = fr.Fractal(coefficients=coefficients, modulus=modulus)
+    assert (fractal.residue_array(24) == reference(coefficients, modulus, 24)).all()
+
+
+def test_vectorized_backends_stop_at_limit():
+    fractal = fr.Fractal(coefficients=[[1, 1], [1, 0]], modulus=fr.MAX_VECTOR_MODULUS + 1)
+    assert fr.choose_backend(fractal, SIZE) == 'python'
+    with pytest.raises(ValueError):
+        fr.Fractal(coefficients=[[1, 1], [1, 0]], modulus=fr.MAX_VECTOR_MODULUS + 1, backend='numpy').residue_array(8)
+
+
+def test_batch_matches_reference():
+    cases = random_cases()[::7] + limit_cases()[:2]
+    fractals = [fr.Fractal(coefficients=coefficients, modulus=modulus) for coefficients, modulus in cases]
+    for fractal, residues in zip(fractals, fr.batch_residue_arrays(fractals, SIZE)):
+        assert (residues == np.array(fractal.reference_residue_array(SIZE))).all()
+    # next fractal
+
+
+@pytest.mark.parametrize('coefficients, modulus', random_cases()[::9] + limit_cases()[:4])
+def test_uncompiled_jit_kernel(coefficients, modulus):
+    # Runs the kernel the 'numba' backend compiles as plain Python, so it is checked without Numba
+    fractal = fr.Fractal(coefficients=coefficients, modulus=modulus)
+    taps, pad = fractal.stencil()
+    grid = np.zeros((pad + 24, pad + 24), dtype=fr.residue_dtype(modulus))
+    jit.fill_rect(grid, pad, taps, modulus, 0, 0, 24, 24, kernel=jit.fill_rect_kernel)
+    assert (grid[pad:, pad:] == reference(coefficients, modulus, 24)).all()
@@ -0,0 +1,61 @@
+import json
+import os
+import pytest
+import batch
+import fractal as fr
+
+# Batch rendering with a tiny grid on one worker: resuming from the manifest, and retrying failures
+
+
+@pytest.fixture
+def jobs(monkeypatch, tmp_path):
+    monkeypatch.setenv('COSMATESQUE_STORE', str(tmp_path / 'store'))     # the workers' make_image stores here
+    return batch.parameter_grid(coefficients=[[0, [1, 2]], [1]], moduli=[2, 3], sizes=[16])
+
+
+def output_path(directory, job):
+    "The file make_image saves job as"
+    coefficients = [list(row) for row in job['coefficients']]
+    coefficients[-1].append(0)
+    fractal = fr.Fractal(coefficients=coefficients, modulus=job['modulus'], white_residues=job['white_residues'])
+    return os.path.join(directory, fractal.summary() + ", picture= '" + job['picture'] + "', size=" + str(job['size'])
+                        + '.png')
+
+
+def test_resumes_from_manifest(tmp_path, jobs):
+    directory = str(tmp_path / 'renders')
+    batch.render_batch(jobs[:2], directory, workers=1)
+    for job in jobs[:2]:
+        os.utime(output_path(directory, job), (1000, 1000))
+    # next job
+
+    reports = []
+    manifest = batch.render_batch(jobs, directory, workers=1, progress=lambda done, total: reports.append(done))
+    assert reports[0] == 2 and reports[-1] == 4
+    assert [os.path.getmtime(output_path(directory, job)) for job in jobs[:2]] == [1000, 1000]
+    assert all(entry['status'] == 'done' and os.path.exists(entry['filename']) for entry in manifest['jobs'].values())
+    with open(os.path.join(directory, batch.MANIFEST_NAME)) as manifest_file:
+        assert json.load(manifest_file) == manifest
+
+    # A finished job whose file has gone is rendered again
+    os.remove(output_path(directory, jobs[3]))
+    reports = []
+    batch.render_batch(jobs, directory, workers=1, progress=lambda done, total: reports.append(done))
+    assert reports == [3, 4]
+    assert os.path.exists(output_path(directory, jobs[3]))
+
+
+def test_retries_failed_jobs(tmp_path, jobs):
+    directory = str(tmp_path / 'renders')
+    os.makedirs(output_path(directory, jobs[1]))    # a directory in the way makes the save fail
+    manifest = batch.render_batch(jobs, directory, workers=1)
+    statuses = [manifest['jobs'][batch.job_key(job)]['status'] for job in jobs]
+    assert statuses == ['done', 'failed', 'done', 'done']
+    assert manifest['jobs'][batch.job_key(jobs[1])]['error']
+
+    os.rmdir(output_path(directory, jobs[1]))
+    reports = []
+    manifest = batch.render_batch(jobs, directory, workers=1, progress=lambda done, total: reports.append(done))
+    assert reports == [3, 4]
+    assert manifest['jobs'][batch.job_key(jobs[1])]['status'] == 'done'
+    assert os.path.isfile(output_path(directory, jobs[1]))
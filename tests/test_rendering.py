@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+from PIL import Image
+import fractal as fr
+import parallel
+import store
+
+# Pinned checks of paths that must agree with the plain ones: streamed saves with whole-image
+# saves, windows with slices of the full array, and cached or stored arrays extended later
+
+
+CASES = [
+    ([[0, 0, 0], [0, 0, 1], [0, 1, 0]], 2, [1]),            # Sierpinski triangle
+    ([[1, 1, 1], [1, 0, 1], [1, 1, 0]], 2, [0]),            # Fredkin's replicator
+    ([[0, 0, 0], [0, 1, 1], [0, 1, 0]], 3, [0, 2]),         # Sierpinski carpet
+    ([[0, 1, 2], [1, 1, 3], [0, 1, 0]], 6, [1, 4, 5]),
+    ([[1, 2, 1], [2, 0, 2], [1, 2, 0]], 7, [0, 3]),
+]
+
+
+def pixels(filename):
+    return np.asarray(Image.open(filename).convert('L'))
+
+
+@pytest.mark.parametrize('coefficients, modulus, white_residues', CASES)
+@pytest.mark.parametrize('picture', ['bw', 'color', 'gradient'])
+@pytest.mark.parametrize('extension', ['png', 'tif'])
+def test_streamed_save_matches_whole(tmp_path, coefficients, modulus, white_residues, picture, extension):
+    whole, streamed = tmp_path / ('whole.' + extension), tmp_path / ('streamed.' + extension)
+    fr.Fractal(coefficients=coefficients, modulus=modulus, white_residues=white_residues).save_image(
+        str(whole), picture, 300, stream=False)
+    fr.Fractal(coefficients=coefficients, modulus=modulus, white_residues=white_residues).save_image(
+        str(streamed), picture, 300, stream=True)
+    assert (pixels(whole) == pixels(streamed)).all()
+
+
+def test_cancelled_save_leaves_no_file(tmp_path):
+    def cancel_at_end(rows_done, rows_total):
+        if rows_done == rows_total:
+            raise fr.RenderCancelled
+
+    for stream in [False, True]:
+        filename = tmp_path / 'cancelled.png'
+        with pytest.raises(fr.RenderCancelled):
+            fr.Fractal().save_image(str(filename), 'bw', 600, stream=stream, progress=cancel_at_end)
+        assert not filename.exists()
+    # next stream
+
+
+@pytest.mark.parametrize('coefficients, modulus, white_residues', CASES)
+@pytest.mark.parametrize('backend', ['numpy', 'prime', 'bitset'])
+def test_save_cancelled_while_computing(tmp_path, coefficients, modulus, white_residues, backend):
+    fractal = fr.Fractal(coefficients=coefficients, modulus=modulus, white_residues=white_residues, backend=backend)
+    if not fr.BACKENDS[backend].supports(fractal, 600):
+        pytest.skip(backend + ' does not handle modulus ' + str(modulus))
+    calls = []
+
+    def cancel_at_checkpoint(rows_done, rows_total):
+        calls.append(rows_done)
+        if len(calls) > 1:     # the first call is the save starting
+            raise fr.RenderCancelled
+
+    filename = tmp_path / 'cancelled.png'
+    with pytest.raises(fr.RenderCancelled):
+        fractal.save_image(str(filename), 'bw', 600, stream=False, progress=cancel_at_checkpoint)
+    assert calls == [0, 0]
+    assert not filename.exists()
+    assert fractal.checkpoint is None
+    assert fractal.known_residue_array(1) is None
+
+
+@pytest.mark.parametrize('coefficients, modulus, white_residues', CASES + [([[1, 1], [1, 0]], 101, [1])])
+@pytest.mark.parametrize('x0, y0, width, height', [(0, 0, 40, 40), (37, 5, 50, 21), (-6, 60, 30, 33),
+                                                   (81, 81, 19, 19)])
+def test_window_matches_slice(coefficients, modulus, white_residues, x0, y0, width, height):
+    full = fr.Fractal(coefficients=coefficients, modulus=modulus).residue_array(120)
+    padded = np.zeros((130, 130), dtype=full.dtype)
+    padded[10:, 10:] = full
+    window = fr.Fractal(coefficients=coefficients, modulus=modulus).residue_window(x0, y0, width, height, 16)
+    assert (window == padded[10 + y0:10 + y0 + height, 10 + x0:10 + x0 + width]).all()
+
+
+@pytest.mark.parametrize('coefficients, modulus, white_residues', CASES)
+def test_cache_extension(coefficients, modulus, white_residues):
+    fractal = fr.Fractal(coefficients=coefficients, modulus=modulus)
+    fractal.residue_array(50)
+    extended = fractal.residue_array(130)
+    assert (extended == np.array(fractal.reference_residue_array(130))).all()
+    # A smaller array put later doesn't displace the larger one
+    fractal.residue_cache.put(fractal.shared_key()[0], np.zeros((10, 10), dtype=extended.dtype))
+    assert fractal.known_residue_array(130).shape[0] == 130
+
+
+@pytest.mark.parametrize('coefficients, modulus, white_residues', CASES)
+def test_store_extension(tmp_path, coefficients, modulus, white_residues):
+    fr.Fractal(coefficients=coefficients, modulus=modulus, store=store.ResidueStore(str(tmp_path))).residue_array(50)
+    # A new Fractal, with its own empty cache, extends the stored array
+    fractal = fr.Fractal(coefficients=coefficients, modulus=modulus, store=store.ResidueStore(str(tmp_path)))
+    assert fractal.known_residue_array(50).shape[0] >= 50
+    assert (fractal.residue_array(130) == np.array(fractal.reference_residue_array(130))).all()
+
+
+def test_transposes_share_entries(tmp_path):
+    coefficients = [[0, 1, 2], [1, 1, 3], [0, 1, 0]]
+    transposed = [list(row) for row in zip(*coefficients)]
+    cache = fr.ResidueCache()
+    fr.Fractal(coefficients=coefficients, modulus=6, cache=cache,
+               store=store.ResidueStore(str(tmp_path))).residue_array(80)
+    for other in [fr.Fractal(coefficients=transposed, modulus=6, cache=cache),
+                  fr.Fractal(coefficients=transposed, modulus=6, store=store.ResidueStore(str(tmp_path)))]:
+        known = other.known_residue_array(80)
+        assert known is not None
+        assert (known == np.array(other.reference_residue_array(80))).all()
+    # next other
+
+
+def test_parallel_bands_stay_within_budget(monkeypatch):
+    monkeypatch.setattr(parallel, 'MAX_BAND_BYTES', 40 * 1000)
+    fractal = fr.Fractal(coefficients=CASES[3][0], modulus=6)
+    taps, pad = fractal.stencil()
+    bands = list(parallel.residue_bands(taps, pad, 6, 300, 300, np.uint8, 20, workers=2))
+    assert max(band.shape[0] for band in bands) <= 40 * 1000 // (pad + 300) - pad
+    assert (np.concatenate(bands) == np.array(fractal.reference_residue_array(300))).all()
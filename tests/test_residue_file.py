@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+import fractal as fr
+
+# Residue arrays computed out of core into memory-mapped .npy files, and reopened later
+
+
+COEFFICIENTS = [[0, 1, 2], [1, 1, 3], [0, 1, 0]]
+
+
+def test_write_and_reopen(tmp_path):
+    filename = str(tmp_path / 'residues.npy')
+    expected = np.array(fr.Fractal(coefficients=COEFFICIENTS, modulus=6).reference_residue_array(200))
+    residues = fr.Fractal(coefficients=COEFFICIENTS, modulus=6).residue_memmap(filename, 200, band_height=64)
+    assert isinstance(residues, np.memmap) and not residues.flags.writeable
+    assert (residues == expected).all()
+
+    stages = []
+    reopened = fr.Fractal(coefficients=COEFFICIENTS, modulus=6, observer=lambda event: stages.append(event['stage']))
+    reopened.open_residue_file(filename)
+    assert (reopened.residue_array(200) == expected).all()
+    assert (reopened.residue_array(70) == expected[:70, :70]).all()
+    assert (np.concatenate(list(reopened.residue_bands(200, 64))) == expected).all()
+    assert 'recurrence' not in stages
+
+
+def test_key_mismatch(tmp_path):
+    filename = str(tmp_path / 'residues.npy')
+    fr.Fractal(coefficients=COEFFICIENTS, modulus=6).residue_memmap(filename, 50)
+    for other in [fr.Fractal(coefficients=COEFFICIENTS, modulus=5),
+                  fr.Fractal(coefficients=[list(row) for row in zip(*COEFFICIENTS)], modulus=6)]:
+        with pytest.raises(ValueError):
+            other.open_residue_file(filename)
+        assert other.residue_file is None
+    # next other
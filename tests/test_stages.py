@@ -0,0 +1,62 @@
+import contextlib
+import tracemalloc
+import numpy as np
+import pytest
+import fractal as fr
+
+# Per-stage instrumentation: the events a render reports, nesting, memory peaks, and nothing at
+# all when there is no observer
+
+
+def test_save_reports_nested_stages(tmp_path):
+    events = []
+    fractal = fr.Fractal(coefficients=[[0, 1, 2], [1, 1, 3], [0, 1, 0]], modulus=6, observer=events.append)
+    fractal.save_image(str(tmp_path / 'picture.png'), 'bw', 300, stream=False)
+    stages = [event['stage'] for event in events]
+    # Inner stages finish, and report, before the save around them
+    assert stages == ['residue lookup', 'recurrence', 'classification', 'encoding', 'save']
+    for event in events:
+        assert event['size'] == 300 and event['parameters'] == fractal.summary()
+        assert event['wall_seconds'] >= 0 and event['cpu_seconds'] >= 0
+        assert event['peak_bytes'] is None     # tracemalloc isn't tracing
+    # next event
+    save = events[-1]
+    assert save['wall_seconds'] >= sum(event['wall_seconds'] for event in events[:-1])
+    assert events[1]['backend'] == fractal.backend_name(300)
+
+
+def test_outer_peak_includes_inner():
+    events = []
+    tracemalloc.start()
+    try:
+        with fr.StageTimer(events.append, 'outer'):
+            with fr.StageTimer(events.append, 'inner'):
+                block = np.ones(2 ** 20, dtype=np.int64)
+                del block
+    finally:
+        tracemalloc.stop()
+    inner, outer = events
+    assert inner['peak_bytes'] >= 8 * 2 ** 20
+    assert outer['peak_bytes'] >= inner['peak_bytes']
+
+
+def test_failed_stage_reports_error():
+    events = []
+    with pytest.raises(fr.RenderCancelled):
+        with fr.StageTimer(events.append, 'outer'):
+            with fr.StageTimer(events.append, 'inner'):
+                raise fr.RenderCancelled
+    assert [(event['stage'], event['error']) for event in events] == [('inner', 'RenderCancelled'),
+                                                                     ('outer', 'RenderCancelled')]
+    assert getattr(fr.StageTimer.nesting, 'stage', None) is None
+
+
+def test_no_observer_no_timers(tmp_path, monkeypatch):
+    def no_timer(*arguments, **fields):
+        raise AssertionError("StageTimer made without an observer")
+
+    monkeypatch.setattr(fr, 'StageTimer', no_timer)
+    fractal = fr.Fractal(modulus=3)
+    assert isinstance(fractal.stage('recurrence', 10), contextlib.nullcontext)
+    fractal.save_image(str(tmp_path / 'picture.png'), 'gradient', 100, stream=False)
+    assert (tmp_path / 'picture.png').exists()
@@ -0,0 +1,76 @@
+import os
+import numpy as np
+import pytest
+import fractal as fr
+import store
+
+# The on-disk residue store: round trips at every packing, least recently used eviction, and
+# writes that either replace an entry whole or leave the old one
+
+
+def entry(coefficients, modulus, size):
+    "Returns (key, residues) for the store, as Fractal.residue_array puts them"
+    fractal = fr.Fractal(coefficients=coefficients, modulus=modulus)
+    return fractal.shared_key()[0], np.array(fractal.reference_residue_array(size), dtype=fr.residue_dtype(modulus))
+
+
+@pytest.mark.parametrize('modulus', [2, 3, 4, 7, 256])
+def test_round_trip(tmp_path, modulus):
+    residue_store = store.ResidueStore(str(tmp_path))
+    key, residues = entry([[0, 1, 1], [1, 1, 1], [1, 1, 0]], modulus, 37)
+    residue_store.put(key, residues)
+    assert residue_store.stored_size(key) == 37
+    assert (residue_store.get(key) == residues).all()
+
+
+def test_keeps_the_larger_array(tmp_path):
+    residue_store = store.ResidueStore(str(tmp_path))
+    key, residues = entry([[0, 1], [1, 0]], 3, 60)
+    residue_store.put(key, residues)
+    residue_store.put(key, residues[:20, :20])
+    assert residue_store.stored_size(key) == 60
+
+
+def test_least_recently_used_evicted(tmp_path):
+    residue_store = store.ResidueStore(str(tmp_path))
+    entries = [entry([[0, 1], [1, 0]], modulus, 50) for modulus in (5, 6, 7)]
+    for age, (key, residues) in zip([1000, 2000, 3000], entries):
+        residue_store.put(key, residues)
+        os.utime(residue_store.path(key), (age, age))
+    # next entry
+    residue_store.get(entries[0][0])      # the oldest, now the most recently used
+    sizes = [os.path.getsize(residue_store.path(key)) for key, residues in entries]
+
+    residue_store.max_bytes = sum(sizes) - 1
+    residue_store.evict()
+    assert [residue_store.get(key) is not None for key, residues in entries] == [True, False, True]
+
+
+def test_stale_temporary_files_cleaned_up(tmp_path):
+    residue_store = store.ResidueStore(str(tmp_path))
+    stale, fresh = tmp_path / 'stale.tmp', tmp_path / 'fresh.tmp'
+    stale.write_bytes(b'partial')
+    fresh.write_bytes(b'being written')
+    age = os.path.getmtime(stale) - store.STALE_TEMP_SECONDS - 1
+    os.utime(stale, (age, age))
+    residue_store.evict()
+    assert not stale.exists() and fresh.exists()
+
+
+def test_failed_replacement_keeps_old_entry(tmp_path, monkeypatch):
+    residue_store = store.ResidueStore(str(tmp_path))
+    key, residues = entry([[0, 1, 2], [1, 1, 3], [0, 1, 0]], 6, 80)
+    residue_store.put(key, residues[:40, :40])
+
+    def fail_replace(source, destination):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store.os, 'replace', fail_replace)
+    residue_store.put(key, residues)
+    monkeypatch.undo()
+    assert (residue_store.get(key) == residues[:40, :40]).all()
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.tmp')] == []
+
+    residue_store.put(key, residues)
+    assert (residue_store.get(key) == residues).all()
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(residue_store.path(key))]
@@ -0,0 +1,96 @@
+import io
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+import numpy as np
+import pytest
+from PIL import Image
+import fractal as fr
+import tileserver
+
+# Serves tiles on a free port and checks them against residue_window, as a viewer would fetch them
+
+
+SUMMARY = '[[0, 1, 1], [1, 1, 1], [1, 1]], modulus=4, white_residues=[1]'
+
+
+@pytest.fixture
+def server():
+    server = tileserver.make_server(port=0, workers=2)
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(server, path):
+    "Returns the status and body of GET path"
+    url = 'http://localhost:' + str(server.server_address[1]) + path
+    try:
+        with urllib.request.urlopen(url) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as error:
+        return error.code, b''
+
+
+def tile_path(summary, z, x, y):
+    return '/tiles/' + urllib.parse.quote(summary, safe='') + '/' + '/'.join(str(n) for n in (z, x, y)) + '.png'
+
+
+@pytest.mark.parametrize('z', [tileserver.MIN_ZOOM, tileserver.NATIVE_ZOOM, tileserver.NATIVE_ZOOM + 2])
+def test_tiles_match_window(server, z):
+    fractal = fr.Fractal.from_summary(SUMMARY)
+    if z < tileserver.NATIVE_ZOOM:
+        cells_per_tile = tileserver.TILE_SIZE << (tileserver.NATIVE_ZOOM - z)
+    else:
+        cells_per_tile = tileserver.TILE_SIZE >> (z - tileserver.NATIVE_ZOOM)
+    indices = np.arange(tileserver.TILE_SIZE) * cells_per_tile // tileserver.TILE_SIZE
+    # Neighbors straddling two meta-tiles, or inside one where meta-tiles are large
+    neighbors = [(3, 2), (4, 2), (3, 3), (4, 3)] if z >= tileserver.NATIVE_ZOOM else [(1, 1), (2, 1), (1, 2), (2, 2)]
+    for x, y in neighbors:
+        status, png_data = fetch(server, tile_path(SUMMARY, z, x, y))
+        assert status == 200
+        pixels = np.asarray(Image.open(io.BytesIO(png_data))).astype(np.uint8)
+        residues = fractal.residue_window(x * cells_per_tile, y * cells_per_tile, cells_per_tile, cells_per_tile)
+        assert (pixels == fractal.classify(residues[indices][:, indices])).all()
+    # next tile
+
+
+def test_meta_tile_rendered_once(server):
+    renderer = server.renderer
+    calls = []
+    render_meta_tile = renderer.render_meta_tile
+
+    def counting(fractal, meta_key):
+        calls.append(meta_key)
+        return render_meta_tile(fractal, meta_key)
+
+    renderer.render_meta_tile = counting
+    statuses = []
+    threads = [threading.Thread(target=lambda x=x, y=y: statuses.append(fetch(server, tile_path(SUMMARY, 4, x, y))[0]))
+               for y in range(tileserver.META_TILES) for x in range(tileserver.META_TILES)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # next thread
+    assert statuses == [200] * len(threads)
+    assert fetch(server, tile_path(SUMMARY, 4, 1, 1))[0] == 200
+    assert calls == [(SUMMARY, 4, 0, 0)]
+
+
+@pytest.mark.parametrize('path', [
+    '/tiles/not%20a%20summary/4/0/0.png',
+    tile_path(SUMMARY, 4, 0, 0)[:-len('.png')],
+    tile_path(SUMMARY, 4, 0, 0).replace('.png', '.jpg'),
+    tile_path(SUMMARY, 4, 0, 0).replace('/4/', '/four/'),
+    tile_path(SUMMARY, 4, 0, 0).replace('/tiles/', '/tile/'),
+    tile_path(SUMMARY, 4, 0, 0) + '/extra',
+    tile_path(SUMMARY, 4, -1, 0),
+    tile_path(SUMMARY, tileserver.MIN_ZOOM - 1, 0, 0),
+    tile_path(SUMMARY, tileserver.MAX_ZOOM + 1, 0, 0),
+])
+def test_bad_paths_are_not_found(server, path):
+    assert fetch(server, path)[0] == 404
@@ -0,0 +1,184 @@
+import argparse
+import collections
+import concurrent.futures
+import http.server
+import io
+import threading
+import urllib.parse
+import numpy as np
+from PIL import Image
+import fractal as fr
+
+# Serves black and white PNG tiles of fractals over HTTP for slippy-map style viewers, from the
+# standard library alone.  Tiles are addressed as
+#
+#   /tiles/<summary>/<z>/<x>/<y>.png
+#
+# where summary is Fractal.summary() percent-encoded, e.g.
+# urllib.parse.quote('[[0, 1], [1]], modulus=2, white_residues=[1]', safe='').  Tile x, y covers
+# cells from (x, y) * TILE_SIZE cells-per-tile onward.  At zoom NATIVE_ZOOM one pixel is one
+# cell; each zoom level in or out doubles or halves that, down to MIN_ZOOM: zoomed out, every cell
+# of a meta-tile is still computed, so each level out costs four times as much.  Tiles are rendered a META_TILES x
+# META_TILES block at a time on a pool of worker threads, so neighboring tiles requested together
+# share one computation, and the hottest are kept in memory.  Example:
+#
+#   python tileserver.py --port 8000
+#
+# then open http://localhost:8000/tiles/%5B%5B0%2C%201%5D%2C%20%5B1%5D%5D%2C%20modulus%3D2%2C%20white_residues%3D%5B1%5D/4/0/0.png
+
+
+TILE_SIZE = 256
+NATIVE_ZOOM = 4     # zoom at which one pixel is one cell
+MIN_ZOOM = 2        # 4 cells per pixel: meta-tiles of 4096 x 4096 cells, 16 times the work of native ones
+MAX_ZOOM = 12       # 256 pixels per cell
+META_TILES = 4      # tiles rendered together along each side
+DEFAULT_CACHE_TILES = 4096
+MAX_FRACTALS = 64   # parameter sets whose Fractal, with its residue cache, is kept
+
+
+class TileRenderer:
+    """
+    Renders tiles as PNG data, keeping the max_tiles most recently used in memory.  A request for
+    a tile not in memory renders its whole meta-tile on the worker pool; requests for tiles of a
+    meta-tile already being rendered wait for that render instead of starting their own.
+    """
+
+    def __init__(self, workers=None, max_tiles=DEFAULT_CACHE_TILES):
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.max_tiles = max_tiles
+        self.tiles = collections.OrderedDict()      # (summary, z, x, y) -> PNG data
+        self.in_flight = {}                         # (summary, z, meta x, meta y) -> future of its tiles
+        self.fractals = collections.OrderedDict()   # summary -> Fractal
+        self.lock = threading.Lock()
+
+    def fractal(self, summary):
+        "Returns the Fractal for summary, kept between requests.  Raises ValueError if summary is malformed"
+        with self.lock:
+            if summary in self.fractals:
+                self.fractals.move_to_end(summary)
+                return self.fractals[summary]
+        new_fractal = fr.Fractal.from_summary(summary)
+        with self.lock:
+            self.fractals[summary] = new_fractal
+            while len(self.fractals) > MAX_FRACTALS:
+                self.fractals.popitem(last=False)
+        return new_fractal
+
+    def tile(self, summary, z, x, y):
+        "Returns PNG data of tile x, y at zoom z.  Raises ValueError for a malformed summary or tile outside the range"
+        if not (MIN_ZOOM <= z <= MAX_ZOOM and x >= 0 and y >= 0):
+            raise ValueError("No tile " + str((z, x, y)))
+        fractal = self.fractal(summary)
+
+        key = (summary, z, x, y)
+        meta_key = (summary, z, x // META_TILES, y // META_TILES)
+        with self.lock:
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+                return self.tiles[key]
+            future = self.in_flight.get(meta_key)
+            if future is None:
+                future = self.pool.submit(self.render_meta_tile, fractal, meta_key)
+                self.in_flight[meta_key] = future
+        return future.result()[key]
+
+    def render_meta_tile(self, fractal, meta_key):
+        "Renders every tile of a meta-tile from one residue window, caches them and returns them by key"
+        summary, z, meta_x, meta_y = meta_key
+        try:
+            if z < NATIVE_ZOOM:
+                cells_per_tile = TILE_SIZE << (NATIVE_ZOOM - z)
+            else:
+                cells_per_tile = max(TILE_SIZE >> (z - NATIVE_ZOOM), 1)
+            side = META_TILES * cells_per_tile
+            residues = fractal.residue_window(meta_x * side, meta_y * side, side, side)
+
+            # Scale cells to pixels: sample every stride-th cell zoomed out, repeat cells zoomed in,
+            # classifying only the cells sampled
+            indices = np.arange(META_TILES * TILE_SIZE) * cells_per_tile // TILE_SIZE
+            pixels = fractal.classify(residues[indices][:, indices])
+            del residues
+
+            rendered = {}
+            for j in range(META_TILES):
+                for i in range(META_TILES):
+                    tile_pixels = pixels[j * TILE_SIZE:(j + 1) * TILE_SIZE, i * TILE_SIZE:(i + 1) * TILE_SIZE]
+                    img = Image.frombytes('1', (TILE_SIZE, TILE_SIZE), np.packbits(tile_pixels, axis=1).tobytes())
+                    png_data = io.BytesIO()
+                    img.save(png_data, format='PNG')
+                    rendered[(summary, z, meta_x * META_TILES + i, meta_y * META_TILES + j)] = png_data.getvalue()
+                # next i
+            # next j
+
+            with self.lock:
+                self.tiles.update(rendered)
+                while len(self.tiles) > self.max_tiles:
+                    self.tiles.popitem(last=False)
+            return rendered
+        finally:
+            with self.lock:
+                del self.in_flight[meta_key]
+
+
+class TileRequestHandler(http.server.BaseHTTPRequestHandler):
+    "Answers GET /tiles/<summary>/<z>/<x>/<y>.png from the server's TileRenderer"
+
+    def do_GET(self):
+        parts = urllib.parse.urlsplit(self.path).path.split('/')
+        try:
+            if len(parts) != 6 or parts[1] != 'tiles' or not parts[5].endswith('.png'):
+                raise ValueError("Not a tile path: " + self.path)
+            summary = urllib.parse.unquote(parts[2])
+            z, x, y = int(parts[3]), int(parts[4]), int(parts[5][:-len('.png')])
+            png_data = self.server.renderer.tile(summary, z, x, y)
+        except ValueError as error:
+            self.send_error(404, str(error))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(png_data)))
+        self.send_header('Cache-Control', 'public, max-age=86400')    # tiles never change
+        self.send_header('Access-Control-Allow-Origin', '*')            # for viewers served elsewhere
+        self.end_headers()
+        self.wfile.write(png_data)
+
+    def log_message(self, format, *arguments):
+        if self.server.verbose:
+            super().log_message(format, *arguments)
+
+
+def make_server(host='localhost', port=8000, workers=None, max_tiles=DEFAULT_CACHE_TILES, verbose=False):
+    """
+    Returns a ThreadingHTTPServer serving tiles, not yet started: call serve_forever(), for
+    instance on a thread.  Port 0 picks a free port, found afterwards in server_address.
+    """
+    server = http.server.ThreadingHTTPServer((host, port), TileRequestHandler)
+    server.daemon_threads = True
+    server.renderer = TileRenderer(workers, max_tiles)
+    server.verbose = verbose
+    return server
+
+
+def main(arguments=None):
+    "Command line entry point; run python tileserver.py --help for options"
+    parser = argparse.ArgumentParser(description='Serve Cosmatesque tiles over HTTP.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=None, help='rendering threads')
+    parser.add_argument('--cache-tiles', type=int, default=DEFAULT_CACHE_TILES, help='tiles kept in memory')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args(arguments)
+
+    server = make_server(args.host, args.port, args.workers, args.cache_tiles, args.verbose)
+    print('Serving tiles at http://' + args.host + ':' + str(server.server_address[1]) + '/tiles/<summary>/<z>/<x>/<y>.png')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())